@@ -0,0 +1,99 @@
+
+"""
+Splits the website's dataset into the files StreetDifficult loads lazily:
+
+- `manifest.json`: the summary fields, price bands, and every shard's
+  zipcode, price band, bounding box and size
+- `shards/<zipcode>-<band>.json`: one row of summary fields per listing in
+  that zipcode and price band, ordered by price
+- `listings/<zpid>.json`: everything else about a listing (description,
+  photos, properties, schools), fetched when it is selected
+
+    python3 shard.py dataset.json out/
+
+`out` is a symlink to the latest build, in a directory beside it.
+"""
+
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from bisect import bisect_right
+from collections import defaultdict
+
+# Lower bounds of the price bands (the last is open-ended)
+BANDS = [0, 2000, 3000, 4000, 5000, 7500, 10000, 20000]
+
+# The fields of each row in a shard
+FIELDS = ["zpid", "price", "bedrooms", "bathrooms", "latitude", "longitude", "street", "zipcode", "thumbnail"]
+
+def thumbnail(listing: dict) -> str | None:
+    for photo in listing.get("photos") or []:
+        jpeg = (photo.get("mixedSources") or {}).get("jpeg") or []
+        if jpeg: return min(jpeg, key=lambda p: p.get("width") or 0)["url"]
+    return None
+
+def summary(listing: dict) -> list:
+    return [listing["zpid"], listing["price"], listing["bedrooms"], listing["bathrooms"],
+            round(listing["latitude"], 6), round(listing["longitude"], 6),
+            (listing.get("address") or {}).get("streetAddress"), listing["zipcode"], thumbnail(listing)]
+
+def dump(path: str, value):
+    with open(path, "w") as file:
+        json.dump(value, file, separators=(",", ":"))
+
+def publish(staging: str, target: str):
+    """
+    Points the symlink `target` at the build in `staging` with a single
+    rename, so the site serves either the old build or the new one, never
+    neither, and then removes every other build.
+    """
+    link = f"{staging}.link"
+    os.symlink(os.path.basename(staging), link)
+    if os.path.isdir(target) and not os.path.islink(target):
+        # Output from before builds were symlinked; a directory can't be renamed over, so it is moved aside
+        shutil.rmtree(f"{target}.build-old", ignore_errors=True)
+        os.replace(target, f"{target}.build-old")
+    os.replace(link, target)
+
+    # Including any left by builds that failed part way
+    for old in glob.glob(glob.escape(target) + ".build-*"):
+        if old == staging: continue
+        if os.path.islink(old): os.remove(old)
+        else: shutil.rmtree(old, ignore_errors=True)
+
+def build(source: str, target: str):
+    with open(source) as file:
+        listings = json.load(file)
+
+    # Written beside the old output and swapped in, so the site never serves a mix of the two
+    target = target.rstrip("/")
+    staging = f"{target}.build-{time.time_ns()}"
+    os.makedirs(f"{staging}/shards")
+    os.makedirs(f"{staging}/listings")
+
+    shards = defaultdict(list)
+    for listing in listings:
+        band = bisect_right(BANDS, listing["price"]) - 1
+        shards[(listing["zipcode"], band)].append(summary(listing))
+        dump(f"{staging}/listings/{listing['zpid']}.json", listing)
+
+    manifest = []
+    for ((zipcode, band), rows) in sorted(shards.items()):
+        rows.sort(key=lambda row: (row[1], row[0]))
+        name = f"{zipcode}-{band}"
+        dump(f"{staging}/shards/{name}.json", rows)
+
+        latitudes, longitudes = [row[4] for row in rows], [row[5] for row in rows]
+        manifest.append({"file": f"shards/{name}.json", "zipcode": zipcode, "band": band, "count": len(rows),
+                         "bounds": [min(latitudes), min(longitudes), max(latitudes), max(longitudes)]})
+
+    dump(f"{staging}/manifest.json", {"fields": FIELDS, "bands": BANDS, "shards": manifest})
+
+    publish(staging, target)
+    print(f"Wrote {len(listings)} listings in {len(manifest)} shards to {target}")
+
+if __name__ == "__main__":
+    build(sys.argv[1], sys.argv[2])
@@ -79,8 +79,34 @@ const beds = ref_id("beds");
  */
 
 /**
- * @param {Apartment} listing
- * @returns {HTMLElement} The listing rendered as a preview
+ * The fields of an apartment needed to search for it and list it; the rest
+ * are only fetched (see `detail`) once it is selected.
+ *
+ * @typedef {{
+ *   zpid: number,
+ *   price: number,
+ *   bedrooms: number,
+ *   bathrooms: number,
+ *   latitude: number,
+ *   longitude: number,
+ *   street: string,
+ *   zipcode: string,
+ *   thumbnail: string | null,
+ * }} Summary
+ *
+ * @typedef {{
+ *   file: string,
+ *   zipcode: string,
+ *   band: number,
+ *   count: number,
+ *   bounds: [number, number, number, number],
+ * }} Shard The summaries of every apartment in one zipcode and price band. `bounds` is [south, west, north, east].
+ *
+ * @typedef {{
+ *   fields: string[],
+ *   bands: number[],
+ *   shards: Shard[],
+ * }} Manifest
  */
 
 function par(text) {
@@ -89,14 +115,21 @@ function par(text) {
     return txt
 }
 
+/**
+ * @param {Summary} listing
+ * @returns {HTMLElement} The listing rendered as a preview
+ */
 function nodePreview(listing) {
     let node = document.createElement("li");
 
-    let preview = document.createElement("img");
-    preview.src = listing.photos[0].mixedSources.jpeg[0].url;
+    if (listing.thumbnail) {
+        let preview = document.createElement("img");
+        preview.src = listing.thumbnail;
+        preview.loading = "lazy";
+        node.appendChild(preview);
+    }
 
-    node.appendChild(preview);
-    node.appendChild(par(`${listing.address.streetAddress}, ${listing.zipcode}`));
+    node.appendChild(par(`${listing.street}, ${listing.zipcode}`));
     node.appendChild(par(details(listing)));
 
     node.onclick = (_el) => {
@@ -106,30 +139,55 @@ function nodePreview(listing) {
     return node;
 }
 
-const DATASET_URL = "./dataset.json";
+/** Built from dataset.json by BrightData/shard.py */
+const INDEX_URL = "./index/";
 
+/** How many results are rendered at a time */
+const PAGE_SIZE = 50;
 
-/** @type {() => Promise<Apartment[]>} */
-const dataset = memoize(
-    async () => {
-        const raw_data = await fetch(DATASET_URL);
+async function fetchJSON(path) {
+    const response = await fetch(INDEX_URL + path);
+    if (!response.ok) die(`Failed to fetch ${path}: ${response.status}`);
+    return await response.json();
+}
 
-        /** @type {Apartment[]} */
-        let json_data = await raw_data.json();
+/** @type {() => Promise<Manifest>} */
+const manifest = memoize(() => fetchJSON("manifest.json"));
 
-        if (user_mode != "agent") {
-            json_data = json_data.flatMap((apt) => {
-                if (user_mode.indexOf(apt.zpid) == -1) {
-                    return [];
-                } else {
-                    apt.price = NaN;
-                    return [apt];
-                }
-            });
-        }
+/** @type {(file: string) => Promise<Summary[]>} */
+const shard = memoize(async (file) => {
+    const { fields } = await manifest();
+    /** @type {any[][]} */
+    const rows = await fetchJSON(file);
+    return rows.map((row) => Object.fromEntries(fields.map((f, i) => [f, row[i]])));
+});
 
-        return json_data;
-    });
+/** @type {(zpid: number) => Promise<Apartment>} */
+const detail = memoize(async (zpid) => {
+    /** @type {Apartment} */
+    let apt = await fetchJSON(`listings/${zpid}.json`);
+    if (user_mode != "agent") apt.price = NaN;
+    return apt;
+});
+
+/**
+ * @param {Apartment} apt
+ * @returns {Summary}
+ */
+function summarize(apt) {
+    const jpeg = apt.photos.length ? apt.photos[0].mixedSources.jpeg : [];
+    return {
+        zpid: apt.zpid,
+        price: apt.price,
+        bedrooms: apt.bedrooms,
+        bathrooms: apt.bathrooms,
+        latitude: apt.latitude,
+        longitude: apt.longitude,
+        street: apt.address.streetAddress,
+        zipcode: apt.zipcode,
+        thumbnail: jpeg.length ? jpeg[0].url : null,
+    };
+}
 
 /**
  * @template A
@@ -179,13 +237,38 @@ function near(v1, v2, epsilon = 0.0001) {
     }
 }
 
+/**
+ * @param {Shard} sh
+ * @param {any[]} gc Geocoder results the apartments must be in
+ * @returns {boolean} Whether `sh` could hold any apartment in one of `gc`'s areas
+ */
+function shard_near(sh, gc) {
+    const [south, west, north, east] = sh.bounds;
+    const epsilon = 0.0001;
+
+    return gc.some((r) => {
+        if (r.geometry.location_type == "APPROXIMATE") {
+            return r.geometry.bounds.intersects({ south: south, west: west, north: north, east: east });
+        } else {
+            const { lat, lng } = loc(r.geometry.location);
+            return south - epsilon < lat && lat < north + epsilon && west - epsilon < lng && lng < east + epsilon;
+        }
+    });
+}
+
+/**
+ * Incremented by every search, so an older one still loading can tell it has been superseded.
+ */
+let search_id = 0;
+
 async function run_search() {
+    const id = ++search_id;
     const loc = locationInput();
-    let ds = await dataset();
-    const gc = (await geocode(loc.value)).results;
+    const gc = loc.value.trim() !== "" ? (await geocode(loc.value)).results : undefined;
 
-    let dsp = ds.filter((a) => {
-        if (loc.value.trim() !== "") {
+    /** @param {Summary} a */
+    const keep = (a) => {
+        if (gc !== undefined) {
             const al = { lat: a.latitude, lng: a.longitude };
 
             const right_area = gc.find((r) => {
@@ -208,15 +291,62 @@ async function run_search() {
         if (baths().valueAsNumber > a.bathrooms) return false;
 
         return true;
+    };
+
+    if (user_mode !== "agent") {
+        updateListings((await client_listings()).filter(keep), id);
+        return;
+    }
+
+    const { bands, shards } = await manifest();
+
+    // Only the shards in the right price bands and near the right area are fetched
+    let needed = shards.filter((sh) => {
+        const low = bands[sh.band];
+        const high = sh.band + 1 < bands.length ? bands[sh.band + 1] : Infinity;
+        if (rentMax().valueAsNumber < low) return false;
+        if (rentMin().valueAsNumber >= high) return false;
+        return gc === undefined || shard_near(sh, gc);
     });
 
-    console.log(`Filtered out ${ds.length - dsp.length} listings`);
+    console.log(`Searching ${needed.length} of ${shards.length} shards`);
 
-    updateListings(dsp);
+    updateListings(by_band(needed, keep), id);
 }
 
 /**
- * @param {Apartment} listing
+ * The apartments in `shards` which pass `keep`, cheapest first. The shards of
+ * each price band are only fetched once every cheaper band's results have
+ * been taken.
+ *
+ * @param {Shard[]} shards
+ * @param {(a: Summary) => boolean} keep
+ * @returns {AsyncGenerator<Summary>}
+ */
+async function* by_band(shards, keep) {
+    const bands = [...new Set(shards.map((sh) => sh.band))].sort((a, b) => a - b);
+
+    for (let band of bands) {
+        const loaded = await Promise.all(shards.filter((sh) => sh.band === band).map((sh) => shard(sh.file)));
+        let found = loaded.flat().filter(keep);
+        found.sort((a, b) => a.price - b.price);
+        yield* found;
+    }
+}
+
+/**
+ * @returns {Promise<Summary[]>} The client's listings, in the order they were given
+ */
+async function client_listings() {
+    const apts = await Promise.all(user_mode.map((zpid) => detail(zpid).catch((e) => {
+        console.error(e);
+        return undefined;
+    })));
+    return apts.filter((apt) => apt !== undefined).map(summarize);
+}
+
+/**
+ * @param {Summary | Apartment} listing
  */
 function details(listing) {
     const suffix = isNaN(listing.price) ? "" : ` - $${listing.price}`;
@@ -224,10 +354,11 @@ function details(listing) {
 }
 
 /**
- * @param {Apartment} listing
+ * @param {Summary} summary
  */
-async function select(listing) {
+async function select(summary) {
     await google.maps.importLibrary("marker");
+    const listing = await detail(summary.zpid);
 
     let node = document.createElement("div");
     node.id = "selected-result";
@@ -304,17 +435,62 @@ async function select(listing) {
 }
 
 /**
- * @param {Apartment[]} listings
+ * Renders the first page of `listings`, and each next page as the end of the
+ * list is scrolled into view.
+ *
+ * @param {Summary[] | AsyncIterator<Summary>} listings In the order to show them
+ * @param {number} id The search they are the results of
  */
-function updateListings(listings) {
+function updateListings(listings, id) {
     selectedResult().innerHTML = "<h2>Select a listing from the list on the left.</h2>";
 
-    if (user_mode === "agent")
-        listings.sort((a, b) => a.price - b.price);
-    else
-        listings.sort((a, b) => user_mode.indexOf(a.zpid) - user_mode.indexOf(b.zpid));
+    const cursor = Array.isArray(listings) ? listings.values() : listings;
+    let shown = 0;
+
+    let more = document.createElement("li");
+    more.className = "more";
+    more.innerText = "Loading...";
+
+    resultsList().replaceChildren(more);
+
+    let loading = false;
+    const observer = new IntersectionObserver(async (entries) => {
+        if (loading || !entries.some((e) => e.isIntersecting)) return;
+        loading = true;
+
+        let page = [];
+        let done = false;
+        while (page.length < PAGE_SIZE) {
+            const next = await cursor.next();
+            if (search_id !== id) {
+                observer.disconnect();
+                return;
+            }
+            if (next.done) {
+                done = true;
+                break;
+            }
+            page.push(next.value);
+        }
+
+        shown += page.length;
+        more.before(...page.map(nodePreview));
+
+        if (done) {
+            observer.disconnect();
+            more.innerText = shown ? `${shown} listings` : "No listings found";
+            console.log(`Showing ${shown} listings`);
+        }
+
+        loading = false;
+        // Still in view (say, on a tall screen), so load another page right away
+        if (!done) {
+            observer.unobserve(more);
+            observer.observe(more);
+        }
+    }, { root: resultsList() });
 
-    resultsList().replaceChildren(...listings.map(nodePreview));
+    observer.observe(more);
 }
 
 addEventListener("load", async (_win, _ev) => {
@@ -335,6 +511,5 @@ addEventListener("load", async (_win, _ev) => {
             }
         }
     }
-    let ds = await dataset().catch(die);
-    updateListings(ds);
+    await run_search().catch(die);
 });
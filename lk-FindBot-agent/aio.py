@@ -0,0 +1,55 @@
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+import metrics
+
+T = TypeVar('T')
+
+# Threads per pool: how many of each kind of blocking call may be waiting on the network at once
+THREADS = {"geocode": 8, "sheets": 4, "search": 2}
+
+# Each process's pools, and the process they were started in; threads don't survive a fork
+_pools: dict[str, ThreadPoolExecutor] = {}
+_pools_pid: int | None = None
+
+def pool(name: str) -> ThreadPoolExecutor:
+    global _pools, _pools_pid
+    if _pools_pid != os.getpid():
+        _pools, _pools_pid = {}, os.getpid()
+    if name not in _pools:
+        _pools[name] = ThreadPoolExecutor(max_workers=THREADS.get(name, 4), thread_name_prefix=name)
+    return _pools[name]
+
+async def run(name: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs the blocking call `fn(*args, **kwargs)` on the thread pool `name`,
+    leaving the event loop free in the meantime.
+    """
+    return await asyncio.get_running_loop().run_in_executor(pool(name), functools.partial(fn, *args, **kwargs))
+
+class Coalescer:
+    """
+    Shares one in-flight call between every concurrent caller asking for the
+    same key. A caller which gives up waiting doesn't cancel the call for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.inflight: dict[tuple[int, Hashable], asyncio.Future] = {}
+
+    async def __call__(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        # Futures belong to one event loop, so calls are only shared within a loop
+        slot = (id(asyncio.get_running_loop()), key)
+
+        future = self.inflight.get(slot)
+        if future is None:
+            future = self.inflight[slot] = asyncio.ensure_future(call())
+            future.add_done_callback(lambda _: self.inflight.pop(slot, None))
+        else:
+            metrics.count("coalesced", call=self.name)
+
+        return await asyncio.shield(future)
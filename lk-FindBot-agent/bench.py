@@ -0,0 +1,365 @@
+
+"""
+Benchmarks the recommendation pipeline (query, rank, top-k) end to end,
+replaying the interviews in `fixtures/conversations.json` against synthetic
+datasets. OpenAI, Google Maps and Google Sheets are replaced by local
+stand-ins with simulated latency, so no API quota is spent.
+
+The fixture interviews are synthetic: written by hand to cover a range of
+searches, not recorded from real users.
+
+    python3 bench.py --sizes 1000 10000 100000 1000000 --llm-latency 0.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Zip codes and the rough extent of Manhattan, to place synthetic listings in
+ZIPCODES = ["10001", "10002", "10003", "10011", "10013", "10014", "10016", "10019",
+            "10023", "10024", "10025", "10027", "10028", "10029", "10031", "10032", "10034"]
+LATITUDE = (40.700, 40.875)
+LONGITUDE = (-74.020, -73.910)
+AMENITIES = ["Doorman", "Elevator", "Gym", "Roof deck", "Laundry in unit", "Laundry in building",
+             "Dishwasher", "Pets allowed", "Central air", "Balcony", "Storage", "Bike room"]
+
+
+def synthesize(count: int, target: str, seed: int = 0):
+    """
+    Writes a JSON dataset of `count` random listings to `target`, one listing
+    at a time so even a million listings never have to fit in memory at once.
+    """
+    rng = random.Random(seed)
+
+    with open(target + ".tmp", "w") as file:
+        file.write("[")
+        for i in range(count):
+            bedrooms = rng.choices(range(5), weights=[3, 5, 4, 2, 1])[0]
+            zipcode = rng.choice(ZIPCODES)
+            listing = {
+                "address": {"city": "New York", "state": "NY", "zipcode": zipcode,
+                            "streetAddress": f"{rng.randint(1, 999)} {rng.choice(['W', 'E'])} {rng.randint(1, 220)}th St"},
+                "bedrooms": bedrooms,
+                "bathrooms": max(1, bedrooms - rng.randint(0, 1)),
+                "price": int(rng.lognormvariate(8.1 + 0.25 * bedrooms, 0.3)) // 25 * 25,
+                "zipcode": zipcode,
+                "photos": [{"mixedSources": {"jpeg": [{"url": f"https://photos.example/{i}/{j}-{width}.jpg", "width": width}
+                                                      for width in (192, 384, 576)]}}
+                           for j in range(rng.randint(0, 12))],
+                "description": " ".join(rng.choices(AMENITIES, k=rng.randint(5, 30))),
+                "schools": [{"distance": round(rng.uniform(0.1, 2.0), 1), "rating": rng.randint(1, 10),
+                             "link": f"https://schools.example/{rng.randint(1, 500)}", "grades": "K-5",
+                             "level": "Elementary", "type": "Public", "name": f"PS {rng.randint(1, 300)}"}
+                            for _ in range(rng.randint(0, 3))],
+                "longitude": rng.uniform(*LONGITUDE),
+                "latitude": rng.uniform(*LATITUDE),
+                "zpid": 1_000_000 + i,
+                "property": [{"title": "Amenities", "values": rng.sample(AMENITIES, k=rng.randint(1, 6))}],
+            }
+            if i: file.write(",")
+            json.dump(listing, file)
+        file.write("]")
+
+    os.replace(target + ".tmp", target)
+
+
+def text(message) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, str): return content
+    return "\n".join(part["text"] for part in content if part.get("type") == "text")
+
+def digest(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+
+class FakeCompletions:
+    def __init__(self, client: "FakeOpenAI"):
+        self.client = client
+
+    async def parse(self, *, model: str, messages, response_format, **kwargs):
+        parsed = await self.client.answer(messages, response_format)
+        return self.client.completion(messages, parsed, None if parsed is None else parsed.model_dump_json())
+
+    async def create(self, *, model: str, messages, **kwargs):
+        await self.client.answer(messages, None)
+        return self.client.completion(messages, None, "OK")
+
+
+class FakeOpenAI:
+    """
+    A local stand-in for `oai.client`. Structured responses come from the
+    interview's scripted `responses` when it has one for the requested model,
+    and are otherwise made up from the prompt: listing scores are a hash of
+    the listing, and listwise orders sort by that same hash.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency, self.jitter = latency, jitter
+        self.responses: dict[str, dict] = {}
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+        self.beta = SimpleNamespace(chat=self.chat)
+
+    async def answer(self, messages, spec):
+        from oai import conversation_tokens
+
+        self.calls += 1
+        self.prompt_tokens += conversation_tokens(messages)
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if spec is None: return None
+        if spec.__name__ in self.responses:
+            return spec.model_validate(self.responses[spec.__name__])
+
+        prompt = text(messages[-1])
+        listings = [int(zpid) for zpid in re.findall(r"Listing ID (\d+):", prompt)]
+        score = lambda s: digest(s) % 10_000 / 100
+
+        fields = spec.model_fields
+        if "final_score" in fields:
+            return spec(benefits=["Good light"], drawbacks=["Small kitchen"], final_score=score(prompt))
+        if "scores" in fields:
+            return spec(scores=[{"zpid": zpid, "benefits": ["Good light"], "drawbacks": ["Small kitchen"],
+                                 "final_score": score(str(zpid))} for zpid in listings])
+        if "zpids" in fields:
+            return spec(zpids=sorted(listings, key=lambda zpid: score(str(zpid)), reverse=True))
+        return None
+
+    def completion(self, messages, parsed, content: str | None):
+        from oai import conversation_tokens
+
+        message = SimpleNamespace(role="assistant", content=content, parsed=parsed, refusal=None, tool_calls=None)
+        tokens = conversation_tokens(messages)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=50, total_tokens=tokens + 50,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=0)))
+
+
+class FakeMaps:
+    """
+    A local stand-in for `maps.gmaps`, answering from the bundled gazetteer.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def geocode(self, loc, components=None):
+        import gazetteer
+
+        self.calls += 1
+        time.sleep(self.latency)
+        return gazetteer.lookup(loc)
+
+
+@dataclass
+class Stage:
+    size: int
+    name: str
+    seconds: float = 0.0
+    # Peak resident set of the whole process by the end of the stage
+    max_rss_mb: float = 0.0
+    # Peak Python allocations during the stage, if traced
+    traced_mb: float | None = None
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    geocodes: int = 0
+    sheets_calls: int = 0
+    extra: dict = field(default_factory=dict)
+
+    def describe(self) -> str:
+        traced = f"{self.traced_mb:9.1f}" if self.traced_mb is not None else f"{'-':>9}"
+        extra = " ".join(f"{k}={v}" for (k, v) in self.extra.items())
+        return (f"{self.size:>9} {self.name:<10} {self.seconds:9.3f} {self.max_rss_mb:9.1f} {traced} "
+                f"{self.llm_calls:7} {self.prompt_tokens:10} {self.geocodes:5} {self.sheets_calls:6}  {extra}")
+
+HEADER = (f"{'listings':>9} {'stage':<10} {'seconds':>9} {'rss MB':>9} {'traced MB':>9} "
+          f"{'calls':>7} {'tokens':>10} {'geo':>5} {'sheets':>6}")
+
+
+class Bench:
+    def __init__(self, llm: FakeOpenAI, gmaps: FakeMaps, trace: bool):
+        self.llm, self.gmaps, self.trace = llm, gmaps, trace
+        self.stages: list[Stage] = []
+
+    def sheets_calls(self) -> int:
+        from sheets import Notes
+        return sum(sheet.calls for sheet in Notes.sheet.sheets)
+
+    @contextmanager
+    def stage(self, size: int, name: str):
+        stage = Stage(size, name)
+        before = (self.llm.calls, self.llm.prompt_tokens, self.gmaps.calls, self.sheets_calls())
+        if self.trace: tracemalloc.reset_peak()
+        start = time.perf_counter()
+
+        yield stage
+
+        stage.seconds = time.perf_counter() - start
+        if self.trace: stage.traced_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        stage.max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+        after = (self.llm.calls, self.llm.prompt_tokens, self.gmaps.calls, self.sheets_calls())
+        (stage.llm_calls, stage.prompt_tokens, stage.geocodes, stage.sheets_calls) = (a - b for (a, b) in zip(after, before))
+
+        self.stages.append(stage)
+        print(stage.describe(), flush=True)
+
+    async def interview(self, size: int, dataset, fixture: dict, ranker, shortlist: int | None):
+        from interview import Interview
+        from leaderboard import stream_top
+        from programmer import Programmer
+        from retrieval import candidates
+        from scorecache import fingerprint
+        from sheets import Notes
+
+        self.llm.responses = fixture.get("responses", {})
+        name = fixture["name"]
+
+        with self.stage(size, "notes"):
+            iv = Interview(fixture["convo"], Notes())
+
+        with self.stage(size, "query") as stage:
+            programmer = Programmer(iv)
+            listings = await programmer.query(dataset)
+            if programmer.last_query is not None:
+                preferences = await ranker.preferences(iv)
+                iv.fingerprint = fingerprint(programmer.last_query, dataset.version, preferences, ranker)
+            stage.extra.update(interview=name, matches=len(listings.root))
+
+        with self.stage(size, "rank") as stage:
+            listings = candidates(dataset, listings, iv.convo)
+            best = await stream_top(iv, listings, k=5, ranker=ranker, shortlist=shortlist)
+            iv.notes.status(f"COMPLETED: FindBot chose {', '.join(str(l.zpid) for (l, _) in best)}")
+            stage.extra.update(interview=name, top=[lst.zpid for (lst, _) in best])
+
+        with self.stage(size, "flush"):
+            iv.notes.flush()
+
+    async def run(self, size: int, source: str, fixtures: list[dict], ranker, shortlist: int | None):
+        import data
+        import retrieval
+        from index import ListingIndex
+        from retrieval import TextIndex
+
+        with self.stage(size, "snapshot"):
+            snapshot = source + ".snapshot"
+            if os.path.exists(snapshot): os.remove(snapshot)
+            dataset = data.load(source, snapshot)
+
+        with self.stage(size, "index"):
+            ListingIndex.of(dataset)
+            if retrieval.PREORDER or retrieval.CAP:
+                TextIndex.of(dataset)
+
+        for fixture in fixtures:
+            await self.interview(size, dataset, fixture, ranker, shortlist)
+
+
+async def probe(llm: FakeOpenAI):
+    """
+    Checks that `TextAgent` sends its requests through `oai.client`, so the
+    stand-in really is answering them.
+    """
+    from listwise import ListingOrder
+    from sheets import Notes
+    from textagent import TextAgent
+
+    before, error = llm.calls, None
+    try:
+        await TextAgent(init=[{"role": "user", "content": "Listing ID 1:"}], model="gpt-4o-mini",
+                        notes=Notes()).generate_to_spec(ListingOrder)
+    except Exception as e:
+        error = e
+
+    if llm.calls == before:
+        raise SystemExit(f"TextAgent's requests didn't reach the OpenAI stand-in, so it can't be benchmarked "
+                         f"without calling the real API (is it not using oai.client?): {error!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--fixtures", default=os.path.join(HERE, "fixtures", "conversations.json"))
+    parser.add_argument("--workdir", default=os.path.join(HERE, "bench-data"),
+                        help="Where synthetic datasets, snapshots and caches are kept between runs")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds each OpenAI request takes")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Extra random seconds added to each OpenAI request")
+    parser.add_argument("--maps-latency", type=float, default=0.1, help="Seconds each geocode takes")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="Seconds each Sheets API call takes")
+    parser.add_argument("--ranking", choices=["single", "batch"], default="single")
+    parser.add_argument("--shortlist", type=int, default=None)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report peak Python allocations per stage (slows everything down)")
+    parser.add_argument("--json", help="Also append every stage's results to this file as JSON lines")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    sources = {}
+    for size in args.sizes:
+        sources[size] = os.path.join(args.workdir, f"listings-{size}.json")
+        if not os.path.exists(sources[size]):
+            print(f"Generating {size} listings...", flush=True)
+            synthesize(size, sources[size])
+
+    # Everything below reads its configuration at import time
+    smallest = sources[min(args.sizes)]
+    os.environ.update({
+        "DATASET_PATH": smallest,
+        "SNAPSHOT_PATH": smallest + ".snapshot",
+        "GEOCODE_CACHE_PATH": os.path.join(args.workdir, "geocodes.sqlite"),
+        "FINDBOT_SCORE_CACHE_PATH": os.path.join(args.workdir, "scores.sqlite"),
+        "FINDBOT_FAKE_SHEETS": "1",
+        "FINDBOT_FAKE_SHEETS_PATH": os.path.join(args.workdir, "fakesheets.json"),
+        # Anything that bypasses the stand-in fails to connect, rather than spending real quota
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+    })
+    os.environ.pop("FINDBOT_OFFLINE", None)
+    for stale in ("geocodes.sqlite", "geocodes.sqlite-wal", "geocodes.sqlite-shm",
+                  "scores.sqlite", "scores.sqlite-wal", "scores.sqlite-shm", "fakesheets.json"):
+        if os.path.exists(path := os.path.join(args.workdir, stale)): os.remove(path)
+
+    import fakesheets
+    import maps
+    import oai
+    from listwise import BatchRanker
+    from ranker import Ranker
+
+    llm, gmaps = FakeOpenAI(args.llm_latency, args.llm_jitter), FakeMaps(args.maps_latency)
+    oai.client = oai.measure(llm)
+    maps.gmaps = gmaps
+    fakesheets.LATENCY = args.sheets_latency
+
+    with open(args.fixtures) as file:
+        fixtures = json.load(file)
+
+    asyncio.run(probe(llm))
+
+    if args.trace_memory: tracemalloc.start()
+    bench = Bench(llm, gmaps, args.trace_memory)
+    ranker = BatchRanker if args.ranking == "batch" else Ranker
+
+    print(HEADER, flush=True)
+    for size in args.sizes:
+        asyncio.run(bench.run(size, sources[size], fixtures, ranker, args.shortlist))
+
+    if args.json:
+        with open(args.json, "a") as file:
+            for stage in bench.stages:
+                file.write(json.dumps(asdict(stage)) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 
-from os import getenv
-from typing import Annotated, Literal, Optional
+import hashlib
+import json
+import logging
+import tempfile
+import threading
+from array import array
+from collections.abc import Callable, Iterator, Sequence
+from os import getenv, path, stat
+from typing import Annotated, Literal, Optional, overload
 
+import numpy as np
 from pydantic import (AnyUrl, BaseModel, Field, NonNegativeFloat,
                       NonNegativeInt, RootModel, StringConstraints)
 
+from snapshot import Snapshot, write
+from tokens import estimate_tokens
 from utils import panic
 
 Zipcode = Annotated[str, StringConstraints(pattern="^\\d{5}$")]
@@ -36,6 +46,13 @@ class Photo(BaseModel):
 
     mixedSources: MixedSource
 
+    def best_url(self, width: int = 450) -> str | None:
+        """
+        The URL of the version of this photo closest to `width` pixels wide.
+        """
+        best = min(self.mixedSources.jpeg, key=lambda l: abs(width - l.width), default=None)
+        return None if best is None else str(best.url)
+
 class School(BaseModel):
     distance: NonNegativeFloat
     rating: Optional[NonNegativeInt] = None
@@ -75,8 +92,17 @@ class Listing(BaseModel):
         Listing Description: {self.description}
         """
 
+    def summary_tokens(self) -> int:
+        return estimate_tokens(self.summarize())
+
+    def photo_urls(self, count: int = 10) -> list[str]:
+        """
+        The URL of each of the first `count` photos, in the size the ranker wants.
+        """
+        return [url for photo in self.photos[:count] if (url := photo.best_url()) is not None]
+
     def __eq__(self, other):
-        if isinstance(other, Listing):
+        if isinstance(other, (Listing, ListingView)):
             return self.zpid == other.zpid
         else:
             return NotImplemented
@@ -86,4 +112,268 @@ class Listing(BaseModel):
 
 Listings = RootModel[list[Listing]]
 
-dataset = Listings.parse_file(getenv("DATASET_PATH") or panic())
+# Bumped whenever the snapshot layout changes, so older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+# The searchable fields stored as columns in a snapshot, alongside each listing's full record
+COLUMNS = {
+    "zpid": np.int64,
+    "price": np.int64,
+    "bedrooms": np.int32,
+    "bathrooms": np.int32,
+    "latitude": np.float64,
+    "longitude": np.float64,
+}
+
+# How many photos the ranker looks at per listing, and so how many have URLs chosen in advance
+PHOTOS = 10
+
+class ListingView:
+    """
+    A read-only stand-in for a `Listing`, reading its fields on demand from a
+    memory-mapped snapshot rather than holding its own copy of them. Searchable
+    fields come straight from the snapshot's columns; everything else is
+    parsed from the listing's record the first time it is needed.
+    """
+
+    __slots__ = ("snapshot", "row", "_record")
+
+    def __init__(self, snapshot: Snapshot, row: int):
+        self.snapshot = snapshot
+        self.row = row
+        self._record: dict | None = None
+
+    def _column(self, name: str):
+        return self.snapshot.columns[name][self.row].item()
+
+    @property
+    def record(self) -> dict:
+        if self._record is None:
+            self._record = json.loads(self.snapshot.record(self.row))
+        return self._record
+
+    zpid = property(lambda self: self._column("zpid"))
+    price = property(lambda self: self._column("price"))
+    bedrooms = property(lambda self: self._column("bedrooms"))
+    bathrooms = property(lambda self: self._column("bathrooms"))
+    latitude = property(lambda self: self._column("latitude"))
+    longitude = property(lambda self: self._column("longitude"))
+
+    zipcode = property(lambda self: self.record["zipcode"])
+    description = property(lambda self: self.record["description"])
+    address = property(lambda self: Address.model_validate(self.record["address"]))
+    photos = property(lambda self: [Photo.model_validate(p) for p in self.record["photos"]])
+    schools = property(lambda self: [School.model_validate(s) for s in self.record["schools"]])
+    properties = property(lambda self: [Property.model_validate(p) for p in self.record["property"]])
+
+    def summarize(self) -> str:
+        return self.record["summary"]
+
+    def summary_tokens(self) -> int:
+        return self._column("tokens")
+
+    def photo_urls(self, count: int = 10) -> list[str]:
+        return [url for url in self.record["photo_urls"][:count] if url is not None]
+
+    def model(self) -> Listing:
+        """
+        A full, independent `Listing` with this view's contents.
+        """
+        return Listing.model_validate_json(self.snapshot.record(self.row))
+
+    __eq__ = Listing.__eq__
+
+    def __hash__(self):
+        return self.zpid
+
+    def __repr__(self):
+        return f"ListingView(zpid={self.zpid})"
+
+class Rows(Sequence[ListingView]):
+    """
+    The listings of a snapshot, as views onto it.
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return len(self.snapshot)
+
+    @overload
+    def __getitem__(self, row: int) -> ListingView: ...
+    @overload
+    def __getitem__(self, row: slice) -> list[ListingView]: ...
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return ListingView(self.snapshot, int(row) % len(self))
+
+class Dataset:
+    """
+    A dataset of listings, backed by a memory-mapped snapshot. Like `Listings`,
+    its listings are in `root`, though as `ListingView`s. Every process that
+    loads the same snapshot shares a single copy of it through the page cache.
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+        self.root = Rows(snapshot)
+
+    @property
+    def version(self) -> str:
+        return self.snapshot.checksum
+
+    def column(self, name: str) -> np.ndarray:
+        return self.snapshot.columns[name]
+
+    def __len__(self) -> int:
+        return len(self.snapshot)
+
+def checksum(source: str) -> str:
+    with open(source, 'rb') as file:
+        digest = hashlib.file_digest(file, 'blake2b').hexdigest()
+    return f"v{SNAPSHOT_VERSION}:{digest}"
+
+def record(lst: Listing) -> bytes:
+    """
+    A listing's snapshot record: the listing itself, plus its summary and the
+    photo URLs the ranker uses, worked out once here instead of every time
+    the listing is ranked. (`Listing` ignores the extra fields when parsing.)
+    """
+    return json.dumps({
+        **lst.model_dump(mode='json', by_alias=True),
+        "summary": lst.summarize(),
+        # One entry per photo (None if it has no usable version), so any prefix can be taken
+        "photo_urls": [photo.best_url() for photo in lst.photos[:PHOTOS]],
+    }).encode()
+
+def parse(source: str, chunk: int = 1 << 20) -> Iterator[Listing]:
+    """
+    The listings in the JSON dataset at `source`, read and validated one at a
+    time, so the whole dataset is never in memory at once. It may be a JSON
+    array of listings, or one listing per line.
+    """
+    decoder = json.JSONDecoder()
+    with open(source, encoding='utf-8') as file:
+        buffer, at, done = "", 0, False
+        while True:
+            # Skip to the next listing, past the array's brackets and commas
+            while at < len(buffer) and (buffer[at].isspace() or buffer[at] in "[,]"):
+                at += 1
+            try:
+                (value, end) = decoder.raw_decode(buffer, at)
+                # A listing running up to the end of what has been read may not be all of it
+                if end == len(buffer) and not done: raise ValueError("incomplete")
+            except ValueError:
+                if done:
+                    if at == len(buffer): return
+                    raise
+                more = file.read(chunk)
+                buffer, at, done = buffer[at:] + more, 0, not more
+                continue
+            yield Listing.model_validate(value)
+            at = end
+
+def compile_snapshot(source: str, target: str, digest: str | None = None):
+    """
+    Validates the JSON dataset at `source` and writes it to `target` as a
+    snapshot. Listings are encoded as they are read, their records spooled to
+    a scratch file and only their columns kept in memory.
+    """
+    dtypes = {**COLUMNS, "tokens": np.int32}
+    columns = {name: array(np.dtype(dtype).char) for (name, dtype) in dtypes.items()}
+    lengths = array(np.dtype(np.int64).char)
+
+    with tempfile.TemporaryFile(dir=path.dirname(path.abspath(target))) as spool:
+        for lst in parse(source):
+            for (name, column) in columns.items():
+                column.append(lst.summary_tokens() if name == "tokens" else getattr(lst, name))
+            lengths.append(spool.write(record(lst)))
+
+        spool.seek(0)
+        write(target, digest or checksum(source),
+              {name: np.frombuffer(column, dtype=dtypes[name]) for (name, column) in columns.items()},
+              iter(lambda: spool.read(1 << 20), b""), np.frombuffer(lengths, dtype=np.int64))
+
+def load(source: str, target: str | None = None) -> Dataset:
+    """
+    Opens the snapshot of the JSON dataset at `source`, (re)compiling it first
+    if it is missing or its checksum no longer matches the source.
+    """
+    target = target or source + ".snapshot"
+
+    if not path.exists(source):
+        return Dataset(Snapshot(target))
+
+    digest = checksum(source)
+    try:
+        snapshot = Snapshot(target)
+        # Deltas applied since it was compiled don't make a snapshot stale
+        if snapshot.source == digest:
+            return Dataset(snapshot)
+        logging.info("Snapshot %s is stale, recompiling", target)
+    except (FileNotFoundError, ValueError):
+        logging.info("No usable snapshot at %s, compiling", target)
+
+    compile_snapshot(source, target, digest)
+    return Dataset(Snapshot(target))
+
+class Live:
+    """
+    The latest version of a dataset, reopened whenever its snapshot file is
+    replaced (say, by `ingest.py`). Jobs should call `current` once and hold
+    on to the result, so each one sees a single version throughout.
+
+    A new version is opened, and everything in `warm` built from it, on a
+    thread of its own; `current` carries on returning the old one until then.
+    """
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+        self.path = dataset.snapshot.path
+        self.identity = self.stat()
+        # Called with each new version before it becomes current, to build what jobs will want of it
+        self.warm: list[Callable[[Dataset], object]] = []
+        # The snapshot being reopened, if any
+        self.loading: tuple[int, int] | None = None
+        self.lock = threading.Lock()
+
+    def stat(self) -> tuple[int, int]:
+        info = stat(self.path)
+        return (info.st_ino, info.st_mtime_ns)
+
+    def current(self) -> Dataset:
+        try:
+            identity = self.stat()
+        except FileNotFoundError:
+            return self.dataset
+
+        with self.lock:
+            if identity != self.identity and identity != self.loading:
+                self.loading = identity
+                threading.Thread(target=self.reload, args=(identity,), name="reload", daemon=True).start()
+            return self.dataset
+
+    def reload(self, identity: tuple[int, int]):
+        try:
+            dataset = Dataset(Snapshot(self.path))
+            for build in self.warm:
+                build(dataset)
+        except Exception:
+            # Left as loading, so it isn't tried again until the snapshot is next replaced
+            logging.exception("Failed to reload %s", self.path)
+            return
+
+        with self.lock:
+            self.dataset, self.identity = dataset, identity
+        logging.info("Reloaded %s: now version %s with %d listings", self.path, dataset.version, len(dataset))
+
+dataset = load(getenv("DATASET_PATH") or panic(), getenv("SNAPSHOT_PATH"))
+live = Live(dataset)
+
+if __name__ == "__main__":
+    print(f"Loaded {len(dataset)} listings from {dataset.snapshot.path}")
@@ -0,0 +1,216 @@
+
+"""
+A local stand-in for the parts of gspread that `sheets.Notes` uses, for
+running FindBot without a Google service account. Set `FINDBOT_FAKE_SHEETS`
+to use it. The spreadsheets are kept in a JSON file (`FINDBOT_FAKE_SHEETS_PATH`,
+default `./fakesheets.json`), so the interviewer and the recommendation
+workers all see the same ones.
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from os import getenv
+from time import sleep
+
+from gspread.cell import Cell
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+
+# Seconds each API call takes, to simulate the real service's round trips
+LATENCY = 0.0
+
+PATH = getenv("FINDBOT_FAKE_SHEETS_PATH") or "./fakesheets.json"
+
+
+class FakeResponse:
+    """
+    Just enough of a `requests.Response` to build a gspread `APIError` from.
+    """
+
+    def __init__(self, code: int = 429, message: str = "Quota exceeded"):
+        self.status_code = code
+        self.text = message
+
+    def json(self):
+        status = "RESOURCE_EXHAUSTED" if self.status_code == 429 else "INVALID_ARGUMENT"
+        return {"error": {"code": self.status_code, "message": self.text, "status": status}}
+
+
+class Store:
+    """
+    Every spreadsheet's worksheets and their rows, as a JSON file. Each call
+    reads and rewrites the whole file under an exclusive lock, which is slow
+    but plenty for a fake.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # flock only excludes other processes, so threads take this as well
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def open(self):
+        with self.lock, open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as file:
+                    state = json.load(file)
+            except FileNotFoundError:
+                state = {}
+
+            yield state
+
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as file:
+                json.dump(state, file)
+            os.replace(tmp, self.path)
+
+
+class Worksheet:
+    def __init__(self, store: Store, spreadsheet: str, title: str):
+        self.store = store
+        self.spreadsheet = spreadsheet
+        self.title = title
+        # Number of upcoming calls that should fail with a rate-limit error
+        self.failures = 0
+        # Calls made through this handle, in this process
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if LATENCY: sleep(LATENCY)
+        if self.failures > 0:
+            self.failures -= 1
+            raise APIError(FakeResponse())
+
+    @contextmanager
+    def _rows(self):
+        with self.store.open() as state:
+            sheets = state.get(self.spreadsheet, {})
+            if self.title not in sheets: raise WorksheetNotFound(self.title)
+            yield sheets[self.title]
+
+    @staticmethod
+    def _cell(rows: list[list[str]], row: int, col: int) -> str:
+        if row > len(rows) or col > len(rows[row - 1]):
+            return ""
+        return rows[row - 1][col - 1]
+
+    @staticmethod
+    def _set(rows: list[list[str]], row: int, col: int, value):
+        while len(rows) < row:
+            rows.append([])
+        line = rows[row - 1]
+        while len(line) < col:
+            line.append("")
+        line[col - 1] = str(value)
+
+    def get(self, range_name: str, major_dimension: str = "ROWS"):
+        self._call()
+        # Only whole-column ranges such as "A2:A" are supported
+        match = re.fullmatch(r"([A-Z]+)(\d+):\1", range_name) or re.fullmatch(r"([A-Z]+)(\d+)", range_name)
+        assert match and major_dimension == "COLUMNS", f"Unsupported range {range_name}"
+        _, col = a1_to_rowcol(f"{match[1]}1")
+        with self._rows() as rows:
+            values = [self._cell(rows, r, col) for r in range(int(match[2]), len(rows) + 1)]
+        return [[v for v in values if v != ""]]
+
+    def insert_row(self, values, index: int = 1):
+        self.insert_rows([values], row=index)
+
+    def insert_rows(self, values, row: int = 1):
+        self._call()
+        with self._rows() as rows:
+            while len(rows) < row - 1:
+                rows.append([])
+            rows[row - 1:row - 1] = [[str(v) for v in line] for line in values]
+
+    def append_rows(self, values):
+        self._call()
+        with self._rows() as rows:
+            rows.extend([str(v) for v in line] for line in values)
+
+    def find(self, query: str, in_column: int | None = None) -> Cell | None:
+        self._call()
+        with self._rows() as rows:
+            for (r, line) in enumerate(rows, start=1):
+                for (c, value) in enumerate(line, start=1):
+                    if value == query and in_column in (None, c):
+                        return Cell(r, c, value)
+        return None
+
+    def update_cell(self, row: int, col: int, value):
+        self._call()
+        with self._rows() as rows:
+            self._set(rows, row, col, value)
+
+    def batch_get(self, ranges):
+        self._call()
+        with self._rows() as rows:
+            return [[[self._cell(rows, *a1_to_rowcol(cell))]] for cell in ranges]
+
+    def batch_update(self, data):
+        self._call()
+        with self._rows() as rows:
+            for update in data:
+                row, col = a1_to_rowcol(update["range"])
+                for (i, line) in enumerate(update["values"]):
+                    for (j, value) in enumerate(line):
+                        self._set(rows, row + i, col + j, value)
+
+
+class Spreadsheet:
+    def __init__(self, store: Store, title: str):
+        self.store = store
+        self.title = title
+        # One handle per worksheet, so its call count and injected failures persist
+        self.handles: dict[str, Worksheet] = {}
+
+        with store.open() as state:
+            state.setdefault(title, {"Sheet1": []})
+
+    def _handle(self, title: str) -> Worksheet:
+        if title not in self.handles:
+            self.handles[title] = Worksheet(self.store, self.title, title)
+        return self.handles[title]
+
+    @property
+    def sheets(self) -> list[Worksheet]:
+        with self.store.open() as state:
+            titles = list(state[self.title])
+        return [self._handle(title) for title in titles]
+
+    @property
+    def sheet1(self) -> Worksheet:
+        return self.sheets[0]
+
+    def worksheet(self, title: str) -> Worksheet:
+        with self.store.open() as state:
+            if title not in state[self.title]: raise WorksheetNotFound(title)
+        return self._handle(title)
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> Worksheet:
+        with self.store.open() as state:
+            if title in state[self.title]:
+                raise APIError(FakeResponse(400, f'A sheet with the name "{title}" already exists.'))
+            state[self.title][title] = []
+        return self._handle(title)
+
+
+class Client:
+    def __init__(self, store: Store):
+        self.store = store
+        self.spreadsheets: dict[str, Spreadsheet] = {}
+
+    def open(self, title: str) -> Spreadsheet:
+        if title not in self.spreadsheets:
+            self.spreadsheets[title] = Spreadsheet(self.store, title)
+        return self.spreadsheets[title]
+
+
+def service_account(filename: str | None = None) -> Client:
+    return Client(Store(PATH))
@@ -1,15 +1,16 @@
 
 import asyncio
-import heapq
 import io
-import multiprocessing as mp
 import os
-import pickle
+import signal
 import socket
 import socketserver
+import time
 import traceback
 import typing
 from dataclasses import dataclass
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Event
 from typing import Never, Self
 
 from dotenv import load_dotenv
@@ -19,43 +20,134 @@ load_dotenv(dotenv_path=".env.local")
 from livekit.agents import JobContext
 from livekit.agents.worker import Worker, WorkerOptions
 
+import metrics
+import retrieval
 import sheets
-from data import dataset
+import data
+from index import ListingIndex
 from interview import Interview
 from interviewer import Interviewer
+from jobs import Job, JobQueue
+from leaderboard import stream_top
+from listwise import BatchRanker
+from pool import WorkerPool
 from programmer import Programmer
+from retrieval import TextIndex, candidates
 from ranker import Ranker
+from scorecache import fingerprint
+from speculate import Draft, Speculator, digest
+
+# Built on import, so the workers' fork server builds them once for all of them, and for every new
+# version of the dataset before jobs are given it
+data.live.warm.append(ListingIndex.of)
+if retrieval.PREORDER or retrieval.CAP:
+    data.live.warm.append(TextIndex.of)
+for build in data.live.warm:
+    build(data.dataset)
+
+# Finished interviews waiting to be turned into recommendations
+jobs = JobQueue(os.getenv("JOB_QUEUE_PATH") or "./jobs.sqlite")
+metrics.gauge("job_queue_depth", jobs.depth)
+
+# Recommendation worker processes
+WORKERS = int(os.getenv("FINDBOT_WORKERS") or 2)
+# Jobs each worker process handles at once
+CONSUMERS = int(os.getenv("FINDBOT_CONSUMERS") or 4)
+# Seconds workers get to finish their jobs on shutdown
+DRAIN = float(os.getenv("FINDBOT_DRAIN_TIMEOUT") or JobQueue.LEASE)
+# Seconds between checks of an empty queue
+POLL = 1.0
+
+# Rate listings several to a request ("batch") or one at a time (anything else)
+RANKER = BatchRanker if os.getenv("FINDBOT_RANKING") == "batch" else Ranker
+# If set, only this many listings, picked by a cheap text-only pre-rank, are rated with their photos
+SHORTLIST = int(os.getenv("FINDBOT_SHORTLIST") or 0) or None
+# Draft queries and pre-score listings while interviews are still going
+SPECULATE = bool(os.getenv("FINDBOT_SPECULATE"))
+# If set, ranking stops after this many seconds, or once this many prompt tokens have been spent,
+# recommending the best listings scored by then
+DEADLINE = float(os.getenv("FINDBOT_RANK_DEADLINE") or 0) or None
+TOKEN_BUDGET = int(os.getenv("FINDBOT_RANK_TOKEN_BUDGET") or 0) or None
+
+async def _recommend(job: Job):
+    notes = None
+    span = metrics.span("recommend")
+    try:
+        notes = await sheets.Notes.afrom_id(job.payload["number"])
+
+        iv = Interview(job.payload["convo"], notes)
+        draft = Draft.model_validate(job.payload["draft"]) if job.payload.get("draft") else None
+
+        # The whole job sees one version of the dataset, even if a newer one is ingested meanwhile
+        dataset = data.live.current()
+        notes.log(f"Recommending from dataset version {dataset.version} ({len(dataset)} listings)")
+
+        programmer = Programmer(iv)
+        # A query drafted from everything the user said is as good as a new one
+        listings = await programmer.query(dataset, draft=draft.query if draft and draft.transcript == digest(iv.convo) else None)
+
+        if programmer.last_query is not None:
+            preferences = await RANKER.preferences(iv)
+            iv.fingerprint = fingerprint(programmer.last_query, dataset.version, preferences, RANKER)
+
+            # Listings scored during the interview needn't be scored again, as long as the final query and
+            # profile are the ones they were scored under
+            if draft and await draft.holds(iv, programmer.last_query, dataset.version, RANKER):
+                iv.prescored = draft.scores
+                notes.log(f"Reusing {len(draft.scores)} scores from the interview")
+
+        listings = candidates(dataset, listings, iv.convo)
+
+        best = await stream_top(iv, listings, k=5, deadline=DEADLINE, token_budget=TOKEN_BUDGET,
+                                ranker=RANKER, shortlist=SHORTLIST)
+
+        ending_status = f"COMPLETED: FindBot chose {', '.join(str(l.zpid) for (l, _) in best)}"
+
+        iv.notes.status(ending_status)
+
+        jobs.ack(job)
+        span.end()
+    except Exception as e:
+        span.end(e)
+        sio = io.StringIO()
+        traceback.TracebackException.from_exception(e).print(file=sio)
+        retrying = jobs.fail(job, sio.getvalue())
+        if notes is not None:
+            notes.status(f"FAILED: {e}" + (f" (retrying, attempt {job.attempts})" if retrying else ""))
+            notes.log(sio.getvalue())
+
+async def _consume(worker: str, stopping: Event):
+    while not stopping.is_set():
+        job = await asyncio.to_thread(jobs.claim, worker)
+        if job is None:
+            await asyncio.sleep(POLL)
+        else:
+            await _recommend(job)
+
+async def _beat(heartbeat: Synchronized) -> Never:
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(WorkerPool.HEARTBEAT)
 
-if not os.path.exists("./test"):
-    os.mkfifo("./test")
+async def _select(stopping: Event, heartbeat: Synchronized):
+    beat = asyncio.create_task(_beat(heartbeat))
+    try:
+        await asyncio.gather(*(_consume(f"{os.getpid()}-{i}", stopping) for i in range(CONSUMERS)))
+    finally:
+        beat.cancel()
 
-async def _select() -> Never:
-    while True:
-        try:
-            fifo = open("./test", 'br')
-            (convo, num) = pickle.load(fifo)
-            
-            notes = sheets.Notes.from_id(num)
-
-            iv = Interview(convo, notes)
-                
-            programmer = Programmer(iv)
-            listings = await programmer.query(dataset)
-                
-            ranked = await Ranker.rank_all(iv, listings)
-                
-            best = heapq.nlargest(5, ranked, key=lambda k: k[1].final_score)
-                
-            ending_status = f"COMPLETED: FindBot chose {', '.join(str(l.zpid) for (l, _) in best)}"
-                
-            iv.notes.status(ending_status)
-
-            fifo.close()
-        except Exception as e:
-            sio = io.StringIO()
-            iv.notes.status(f"FAILED: {e}")
-            traceback.TracebackException.from_exception(e).print(file=sio)
-            iv.notes.log(sio.getvalue())
+def _work(index: int, stopping: Event, heartbeat: Synchronized):
+    # Ctrl-C reaches every process in the group; the pool drains its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # The interview process serves its metrics on the port itself; worker i uses the i+1th one after it
+    if metrics.PORT:
+        metrics.registry.serve(metrics.PORT + 1 + index)
+
+    asyncio.run(_select(stopping, heartbeat))
+
+    # Worker processes exit without running atexit handlers
+    sheets.Notes.drain()
 
 @dataclass
 class FindBot:
@@ -65,10 +157,18 @@ class FindBot:
 
     def start(self):
         print('STARTING')
-        pr = mp.Process(target=lambda: asyncio.run(_select()))
-        pr.start()
-        asyncio.run(self._interview())
-        pr.join()
+        # Jobs a dead worker was holding go straight back on the queue
+        pool = WorkerPool(WORKERS, _work, on_exit=lambda pid: jobs.release(f"{pid}-"))
+        pool.start()
+
+        metrics.gauge("workers_alive", pool.alive)
+        if metrics.PORT:
+            metrics.registry.serve(metrics.PORT)
+
+        try:
+            asyncio.run(self._interview())
+        finally:
+            pool.drain(DRAIN)
 
     @staticmethod
     async def on_job(ctx: JobContext):
@@ -76,12 +176,15 @@ class FindBot:
 
         client = await ctx.wait_for_participant()
 
-        iv = await Interviewer().run_interview(ctx, client)
+        speculator = Speculator(data.live.current(), RANKER) if SPECULATE else None
+
+        iv = await Interviewer().run_interview(ctx, client, speculator)
 
-        iv.notes.flush()
+        await iv.notes.aflush()
 
-        with open("./test", 'bw') as fifo:
-            pickle.dump((iv.convo, iv.notes.number), fifo)
+        draft = speculator.draft if speculator is not None else None
+        await asyncio.to_thread(jobs.put, {"convo": iv.convo, "number": iv.notes.number,
+                                           "draft": draft and draft.model_dump(mode="json")})
 
         ctx.shutdown()
 
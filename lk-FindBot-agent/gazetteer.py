@@ -0,0 +1,57 @@
+
+import difflib
+import json
+import logging
+import re
+from functools import cache
+from os import getenv, path
+
+from geocache import normalize
+
+GAZETTEER_PATH = getenv("GAZETTEER_PATH") or path.join(path.dirname(__file__), "neighborhoods.json")
+
+def simplify(name: str) -> str:
+    """
+    A place name with case, punctuation, and any leading "the" stripped.
+    """
+    name = normalize(re.sub(r"[^\w\s-]", "", name))
+    return re.sub(r"^the ", "", name)
+
+@cache
+def entries() -> dict[str, dict]:
+    """
+    Every gazetteer entry, keyed by the simplified form of its name and each of its aliases.
+    """
+    with open(GAZETTEER_PATH) as file:
+        hoods = json.load(file)
+
+    return {simplify(alias): hood
+            for hood in hoods
+            for alias in [hood['name'], *hood['aliases']]}
+
+def lookup(name: str) -> list[dict]:
+    """
+    Resolves a neighborhood name against the bundled gazetteer, returning
+    results shaped like those of `maps.geocode`.
+    """
+    table = entries()
+    key = simplify(name)
+
+    if key not in table:
+        close = difflib.get_close_matches(key, table.keys(), n=1, cutoff=0.8)
+        if not close:
+            logging.warning("No gazetteer entry for %s", name)
+            return []
+        key = close[0]
+
+    hood = table[key]
+    ne, sw = hood['bounds']['northeast'], hood['bounds']['southwest']
+
+    return [{
+        "formatted_address": f"{hood['name']}, New York, NY, USA",
+        "geometry": {
+            "location_type": "APPROXIMATE",
+            "bounds": hood['bounds'],
+            "location": {"lat": (ne['lat'] + sw['lat']) / 2, "lng": (ne['lng'] + sw['lng']) / 2},
+        },
+    }]
@@ -0,0 +1,93 @@
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from os import getenv
+from typing import Any
+
+
+def normalize(name: str) -> str:
+    """
+    The cache key for a place name: case-folded, with whitespace collapsed.
+    """
+    return re.sub(r"\s+", " ", name).strip().casefold()
+
+
+class GeocodeCache:
+    """
+    A geocode cache kept in a SQLite file, so it survives restarts and is
+    shared by every process on the machine. Entries expire after `ttl` seconds.
+    """
+
+    # Thirty days: neighborhood boundaries don't move much
+    TTL = 30 * 24 * 60 * 60
+
+    def __init__(self, path: str, ttl: float = TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Entries already read by this process, with the time they were stored
+        self.memo: dict[str, tuple[float, Any]] = {}
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork or a thread, so each opens its own
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocodes (
+                    name TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    stored REAL NOT NULL
+                )""")
+            local.pid = os.getpid()
+        return local.conn
+
+    def get(self, name: str) -> Any | None:
+        key, oldest = normalize(name), time.time() - self.ttl
+
+        if key in self.memo and self.memo[key][0] > oldest:
+            self.hits += 1
+            return self.memo[key][1]
+
+        row = self.conn.execute(
+            "SELECT result, stored FROM geocodes WHERE name = ? AND stored > ?",
+            (key, oldest)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.memo[key] = (row[1], json.loads(row[0]))
+        return self.memo[key][1]
+
+    def put(self, name: str, result: Any):
+        key, stored = normalize(name), time.time()
+        self.memo[key] = (stored, result)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO geocodes (name, result, stored) VALUES (?, ?, ?)",
+            (key, json.dumps(result), stored))
+
+    def evict(self) -> int:
+        """
+        Deletes every expired entry, returning how many there were.
+        """
+        return self.conn.execute("DELETE FROM geocodes WHERE stored <= ?", (time.time() - self.ttl,)).rowcount
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"geocode cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
+
+
+cache = GeocodeCache(getenv("GEOCODE_CACHE_PATH") or "./geocodes.sqlite",
+                     float(getenv("GEOCODE_CACHE_TTL") or GeocodeCache.TTL))
@@ -0,0 +1,131 @@
+
+import threading
+from typing import TYPE_CHECKING, Iterable, Self, Sequence
+
+import numpy as np
+
+from data import Dataset, Listing, Listings
+from maps import includes_all, locate
+from spatial import GridIndex
+
+if TYPE_CHECKING:
+    from programmer import ApartmentQuery
+
+
+class ListingIndex:
+    """
+    Columnar copy of the searchable fields of a dataset. Answers an
+    `ApartmentQuery` with vectorized masks over the rows picked out by its
+    price order or spatial grid, returning row ids into the dataset rather
+    than `Listing` objects.
+    """
+
+    # Indexes already built, keyed by the identity of their dataset
+    _built: dict[int, tuple[Dataset | Listings, "ListingIndex"]] = {}
+    # How many of them to keep, so replaced versions of a dataset can be freed
+    KEEP = 4
+    # Indexes are built on a dataset reload's thread while jobs look up theirs
+    _lock = threading.Lock()
+
+    def __init__(self, price: Sequence[int], bedrooms: Sequence[int], bathrooms: Sequence[int],
+                 latitude: Sequence[float], longitude: Sequence[float]):
+        self.price = np.asarray(price, dtype=np.int64)
+        self.bedrooms = np.asarray(bedrooms, dtype=np.int32)
+        self.bathrooms = np.asarray(bathrooms, dtype=np.int32)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+
+        # Rows ordered by price, so a rent range is a single slice
+        self.by_price = np.argsort(self.price, kind='stable')
+        self.sorted_price = self.price[self.by_price]
+
+        self.grid = GridIndex(self.latitude, self.longitude)
+
+    @classmethod
+    def from_listings(cls, listings: Iterable[Listing]) -> Self:
+        rows = [(l.price, l.bedrooms, l.bathrooms, l.latitude, l.longitude) for l in listings]
+        price, bedrooms, bathrooms, latitude, longitude = zip(*rows) if rows else ((),) * 5
+        return cls(price, bedrooms, bathrooms, latitude, longitude)
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset) -> Self:
+        # Viewing the snapshot's columns directly, so no listing is parsed
+        return cls(*(dataset.column(name) for name in ("price", "bedrooms", "bathrooms", "latitude", "longitude")))
+
+    @classmethod
+    def of(cls, dataset: Dataset | Listings) -> "ListingIndex":
+        """
+        The index for `dataset`, built the first time it is asked for.
+        """
+        with cls._lock:
+            hit = cls._built.get(id(dataset))
+        if hit is None or hit[0] is not dataset:
+            index = cls.from_dataset(dataset) if isinstance(dataset, Dataset) else cls.from_listings(dataset.root)
+            with cls._lock:
+                cls._built.pop(id(dataset), None)
+                hit = cls._built[id(dataset)] = (dataset, index)
+                while len(cls._built) > cls.KEEP:
+                    del cls._built[next(iter(cls._built))]
+        return hit[1]
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+    def rent_rows(self, minimum: int, maximum: int | None) -> np.ndarray:
+        lo = np.searchsorted(self.sorted_price, minimum, side='left')
+        # As in `ApartmentQuery.matches`, a maximum of 0 means no maximum
+        hi = np.searchsorted(self.sorted_price, maximum, side='right') if maximum else len(self)
+        return self.by_price[lo:hi]
+
+    @staticmethod
+    def geometries(query: "ApartmentQuery") -> list[dict]:
+        return [loc['geometry'] for hood in query.neighborhoods or [] for loc in locate(hood.name)]
+
+    def located_rows(self, geometries: Iterable[dict]) -> np.ndarray:
+        regions = [self.grid.region(geometry) for geometry in geometries]
+        return np.unique(np.concatenate(regions)) if regions else np.empty(0, dtype=np.int64)
+
+    def within(self, rows: np.ndarray, geometries: Iterable[dict]) -> np.ndarray:
+        """
+        A mask of which of `rows` lie in any of `geometries`.
+        """
+        lat, lng = self.latitude[rows], self.longitude[rows]
+        mask = np.zeros(len(rows), dtype=bool)
+        for geometry in geometries:
+            mask |= includes_all(geometry, lat, lng)
+        return mask
+
+    def fits(self, rows: np.ndarray, query: "ApartmentQuery") -> np.ndarray:
+        """
+        A mask of which of `rows` meet the rent and room constraints of `query`.
+        """
+        price = self.price[rows]
+        return ((query.minimum_rent <= price)
+                & (price <= (query.maximum_rent or np.inf))
+                & (query.minimum_bedrooms <= self.bedrooms[rows])
+                & (query.minimum_bathrooms <= self.bathrooms[rows]))
+
+    def refine(self, rows: np.ndarray, query: "ApartmentQuery") -> np.ndarray:
+        """
+        The subset of `rows` matching `query`.
+        """
+        rows = rows[self.fits(rows, query)]
+
+        if query.neighborhoods is not None:
+            rows = rows[self.within(rows, self.geometries(query))]
+
+        return rows
+
+    def select(self, query: "ApartmentQuery") -> np.ndarray:
+        """
+        The (sorted) row ids of every listing matching `query`.
+        """
+        if query.neighborhoods is None:
+            rows = np.sort(self.rent_rows(query.minimum_rent, query.maximum_rent))
+        else:
+            rows = self.located_rows(self.geometries(query))
+
+        return rows[self.fits(rows, query)]
+
+    def count(self, query: "ApartmentQuery") -> int:
+        return len(self.select(query))
@@ -0,0 +1,126 @@
+
+"""
+Applies a delta of new, changed and delisted listings to the dataset's
+snapshot, without recompiling it from the whole dump. Workers pick up the new
+version once they have loaded it and built its indexes (see `data.Live`),
+while interviews already being recommended for carry on against the version
+they started with.
+
+    python3 ingest.py delta.json
+
+where `delta.json` looks like `{"upsert": [<listing>, ...], "delete": [<zpid>, ...]}`.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import sys
+from typing import Iterator
+
+import numpy as np
+from pydantic import BaseModel
+
+from data import SNAPSHOT_VERSION, Dataset, Listing, record
+from retrieval import TextIndex
+from snapshot import Snapshot, write
+
+
+class Delta(BaseModel):
+    """
+    Listings to add or replace, and zpids of listings to remove. A zpid in
+    both is removed.
+    """
+    upsert: list[Listing] = []
+    delete: list[int] = []
+
+    def digest(self) -> str:
+        return hashlib.blake2b(self.model_dump_json(by_alias=True).encode(), digest_size=16).hexdigest()
+
+def apply(dataset: Dataset, delta: Delta, target: str | None = None) -> Dataset:
+    """
+    Writes `dataset` with `delta` applied to `target` (by default, over
+    `dataset`'s own snapshot) and returns it. Listings keep their rows where
+    they can; new ones go on the end. Only the changed listings are encoded
+    (and indexed), the rest being copied from the old snapshot as they are.
+
+    Ingests into the same snapshot take turns, each applying its delta to
+    the version the last one left, so that none of them is lost.
+    """
+    target = target or dataset.snapshot.path
+
+    with open(target + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if target == dataset.snapshot.path and (latest := Dataset(Snapshot(target))).version != dataset.version:
+            dataset = latest
+        return patch(dataset, delta, target)
+
+def patch(dataset: Dataset, delta: Delta, target: str) -> Dataset:
+    snapshot = dataset.snapshot
+
+    zpids = dataset.column("zpid")
+    deleted = np.isin(zpids, np.asarray(delta.delete, dtype=np.int64))
+    # The last of several upserts of the same zpid wins
+    gone = set(delta.delete)
+    upserts = {lst.zpid: lst for lst in delta.upsert if lst.zpid not in gone}
+
+    rows = {int(zpid): row for (row, zpid) in enumerate(zpids)}
+    replaced = {rows[zpid]: lst for (zpid, lst) in upserts.items() if zpid in rows}
+    added = [lst for (zpid, lst) in upserts.items() if zpid not in rows]
+
+    kept = np.flatnonzero(~deleted)
+    columns = {name: np.concatenate((column[kept], np.empty(len(added), dtype=column.dtype)))
+               for (name, column) in snapshot.columns.items()}
+
+    at = np.searchsorted(kept, list(replaced), side="left")
+    changes = [*zip(at.tolist(), replaced.values()), *zip(range(len(kept), len(kept) + len(added)), added)]
+    fresh = {}
+    for (row, lst) in changes:
+        for name in columns:
+            columns[name][row] = lst.summary_tokens() if name == "tokens" else getattr(lst, name)
+        fresh[row] = record(lst)
+
+    lengths = np.concatenate((np.diff(snapshot.offsets)[kept], np.zeros(len(added), dtype=np.int64)))
+    for (row, rec) in fresh.items():
+        lengths[row] = len(rec)
+
+    version = f"v{SNAPSHOT_VERSION}:{hashlib.blake2b((dataset.version + delta.digest()).encode()).hexdigest()}"
+
+    # The new version's text index is written before the new snapshot, so nothing sees one without the other
+    if os.path.exists(TextIndex.path(snapshot.path, dataset.version)):
+        index = TextIndex.of(dataset).updated(version, columns["zpid"], kept, changes)
+        index.save(TextIndex.path(target, version))
+
+    write(target, version, columns, records(snapshot, kept, fresh), lengths,
+          source=snapshot.source, parent=dataset.version)
+    # Workers still on the previous version may yet want its index
+    TextIndex.prune(target, {version, dataset.version})
+
+    logging.info("Applied %d upserts (%d new) and %d deletes: %s is now version %s with %d listings",
+                 len(upserts), len(added), int(deleted.sum()), target, version, len(lengths))
+    return Dataset(Snapshot(target))
+
+def records(snapshot: Snapshot, kept: np.ndarray, fresh: dict[int, bytes]) -> Iterator[bytes]:
+    """
+    The records of rows `kept` of `snapshot`, closed up, with those in `fresh`
+    written over or after them: each run of untouched rows in one piece.
+    """
+    over = np.asarray([row for row in fresh if row < len(kept)], dtype=np.int64)
+    # Runs of consecutive rows, split around each row written over
+    cuts = np.union1d(np.flatnonzero(np.diff(kept) != 1) + 1, np.concatenate((over, over + 1)))
+    bounds = [0, *cuts[(cuts > 0) & (cuts < len(kept))].tolist(), len(kept)]
+
+    for (first, last) in zip(bounds, bounds[1:]):
+        if first == last: continue
+        yield fresh[first] if first in fresh else snapshot.span(int(kept[first]), int(kept[last - 1]) + 1)
+    for row in range(len(kept), len(kept) + len(fresh) - len(over)):
+        yield fresh[row]
+
+if __name__ == "__main__":
+    from data import dataset
+    logging.basicConfig(level=logging.INFO)
+
+    with open(sys.argv[1], 'rb') as file:
+        delta = Delta.model_validate_json(file.read())
+    updated = apply(dataset, delta)
+    print(f"Dataset is now version {updated.version} with {len(updated)} listings")
@@ -1,12 +1,32 @@
 
-from oai import Conversation
+from typing import TYPE_CHECKING
+
+from oai import Conversation, Usage
 from sheets import Notes
 
+if TYPE_CHECKING:
+    from profiler import Preferences
+    from ranker import ListingScore
+
 
 class Interview:
     notes: Notes
     convo: Conversation
+    usage: Usage
+    # Identifies the interview's preferences for sharing listing scores, if set
+    fingerprint: str | None
+    # Scores already given to listings by zpid, say while the interview was still going
+    prescored: "dict[int, ListingScore]"
+    # The ranking prefix worked out for the interview, by whether it was condensed
+    prefixes: dict[bool, Conversation]
+    # The preferences distilled from the interview, once they have been
+    profile: "Preferences | None"
 
     def __init__(self,  convo: Conversation, notes: None | Notes = None):
         self.notes = Notes() if notes is None else notes
         self.convo = convo
+        self.usage = Usage()
+        self.fingerprint = None
+        self.prescored = {}
+        self.prefixes = {}
+        self.profile = None
@@ -12,9 +12,11 @@ from openai.types.chat import (ChatCompletionContentPartParam,
                                ChatCompletionMessageParam)
 
 import log
+import metrics
 from interview import Interview
 from oai import Conversation
 from sheets import Notes
+from speculate import Speculator
 from utils import panic
 
 
@@ -52,8 +54,11 @@ You are FindBot, an AI voice agent whose role is to help users find their ideal
                              threshold=0.6, prefix_padding_ms=200, silence_duration_ms=500
                          ))
 
-    def run_interview(self, ctx: JobContext, participant: RemoteParticipant) -> Future[Interview]:
-        notes = Notes()
+    async def run_interview(self, ctx: JobContext, participant: RemoteParticipant,
+                            speculator: Speculator | None = None) -> Interview:
+        notes = await Notes.acreate()
+        # Ends when the user leaves
+        span = metrics.span("interview")
 
         notes.status(f"Interviewing {participant.name}")
 
@@ -65,21 +70,28 @@ You are FindBot, an AI voice agent whose role is to help users find their ideal
         session.conversation.item.create(self.INITIAL_MESSAGE)
         session.response.create()
 
-        future = asyncio.get_event_loop().create_future()
+        if speculator is not None:
+            speculator.start(notes, lambda: [convert(c) for c in session.chat_ctx_copy().messages])
+
+        future: Future[Interview] = asyncio.get_running_loop().create_future()
 
         @ctx.room.on("participant_disconnected")
         def on_disconnect(who_left: RemoteParticipant):
             if who_left.identity != participant.identity: return
 
             notes.status(f"Finished Interviewing #{who_left.identity}")
+            span.end()
 
             msgs = session.chat_ctx_copy().messages
 
             for msg in msgs:
                 notes.log(f"{msg.role}: {msg.content}")
 
+            if speculator is not None:
+                speculator.stop()
+
             future.set_result(Interview([convert(c) for c in msgs], notes))
 
-        return future
+        return await future
 
 
@@ -0,0 +1,122 @@
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class Job:
+    id: int
+    payload: Any
+    attempts: int
+
+
+class JobQueue:
+    """
+    A durable job queue kept in a SQLite file. A claimed job is leased to its
+    worker; if the worker neither acknowledges nor fails it before the lease
+    runs out (say, because it crashed), the job is handed to another worker.
+    """
+
+    # Seconds a worker has to finish a job before it is assumed dead
+    LEASE = 15 * 60
+    # Times a job is tried before it is given up on
+    ATTEMPTS = 3
+
+    def __init__(self, path: str, lease: float = LEASE, attempts: int = ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.attempts = attempts
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork or a thread, so each opens its own
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    leased_until REAL,
+                    worker TEXT,
+                    error TEXT,
+                    created REAL NOT NULL
+                )""")
+            local.pid = os.getpid()
+        return local.conn
+
+    def put(self, payload: Any) -> int:
+        cursor = self.conn.execute("INSERT INTO jobs (payload, created) VALUES (?, ?)",
+                                   (json.dumps(payload), time.time()))
+        return cursor.lastrowid or 0
+
+    def claim(self, worker: str) -> Job | None:
+        """
+        Leases the oldest available job to `worker`, if there is one.
+        """
+        now = time.time()
+        conn = self.conn
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died on their last attempt are not retried again
+            conn.execute("""
+                UPDATE jobs SET state = 'failed', error = 'lease expired'
+                WHERE state = 'running' AND leased_until < ? AND attempts >= ?""", (now, self.attempts))
+
+            row = conn.execute("""
+                SELECT id, payload, attempts FROM jobs
+                WHERE state = 'queued' OR (state = 'running' AND leased_until < ?)
+                ORDER BY id LIMIT 1""", (now,)).fetchone()
+
+            if row is not None:
+                conn.execute("""
+                    UPDATE jobs SET state = 'running', attempts = attempts + 1, leased_until = ?, worker = ?
+                    WHERE id = ?""", (now + self.lease, worker, row[0]))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return None if row is None else Job(row[0], json.loads(row[1]), row[2] + 1)
+
+    def ack(self, job: Job):
+        self.conn.execute("UPDATE jobs SET state = 'done', leased_until = NULL WHERE id = ?", (job.id,))
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Records that `job` failed, requeueing it if it has attempts left.
+        Returns whether it will be retried.
+        """
+        retry = job.attempts < self.attempts
+        self.conn.execute("UPDATE jobs SET state = ?, error = ?, leased_until = NULL WHERE id = ?",
+                          ('queued' if retry else 'failed', error, job.id))
+        return retry
+
+    def release(self, worker: str) -> int:
+        """
+        Hands back the jobs leased to workers whose names start with `worker`,
+        once they are known to be dead, rather than waiting out their leases.
+        Returns how many jobs were released.
+        """
+        cursor = self.conn.execute("""
+            UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                            error = 'worker died', leased_until = NULL
+            WHERE state = 'running' AND worker LIKE ? || '%'""", (self.attempts, worker))
+        return cursor.rowcount
+
+    def depth(self) -> int:
+        """
+        The number of jobs waiting to be claimed.
+        """
+        return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
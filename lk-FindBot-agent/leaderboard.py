@@ -0,0 +1,95 @@
+
+import asyncio
+import heapq
+import time
+from contextlib import aclosing
+
+from data import Listing, Listings
+from interview import Interview
+from listwise import PreRanker
+from ranker import ListingScore, Ranker
+from scorecache import scores as score_cache
+
+class Leaderboard:
+    """
+    A running top-k of listings, updated as scores arrive from the Ranker.
+    """
+
+    def __init__(self, k: int = 5):
+        self.k = k
+        self.heap: list[tuple[float, int, Listing, ListingScore]] = []
+
+    def push(self, lst: Listing, score: ListingScore) -> bool:
+        """
+        Adds a scored listing, returning whether the top-k changed.
+        """
+        entry = (score.final_score, lst.zpid, lst, score)
+
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+            return True
+        if entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+    def best(self) -> list[tuple[Listing, ListingScore]]:
+        return [(lst, score) for (_, _, lst, score) in sorted(self.heap, key=lambda e: e[:2], reverse=True)]
+
+    def describe(self) -> str:
+        return ', '.join(f"{lst.zpid} ({score.final_score:g})" for (lst, score) in self.best())
+
+
+async def stream_top(it: Interview, listings: Listings, k: int = 5,
+                     interval: float = 15.0,
+                     deadline: float | None = None,
+                     token_budget: int | None = None,
+                     ranker: type[Ranker] = Ranker,
+                     shortlist: int | None = None) -> list[tuple[Listing, ListingScore]]:
+    """
+    Ranks `listings` with `ranker`, keeping a running top-k and publishing it
+    through `it.notes.status` at most once every `interval` seconds. If
+    `shortlist` is given, only that many listings, picked by a text-only
+    pre-rank, are ranked in full.
+
+    Ranking stops early once `deadline` seconds have passed, or once
+    `token_budget` prompt tokens have been spent. There is no cheap upper
+    bound on a listing's score before it is ranked, so otherwise every
+    listing is ranked.
+    """
+    it.notes.status("Started Ranking")
+
+    prefix = await ranker.shared_prefix(it)
+
+    if shortlist is not None:
+        listings = await PreRanker.shortlist(it, listings, shortlist, prefix)
+
+    board = Leaderboard(k)
+    unscored = {lst.zpid for lst in listings.root}
+    start_tokens = it.usage.prompt_tokens
+    last_publish = time.monotonic()
+    dirty = False
+    reason = "all listings scored"
+
+    try:
+        async with asyncio.timeout(deadline), aclosing(ranker.stream(it, listings, prefix=prefix)) as scores:
+            async for (lst, score) in scores:
+                unscored.discard(lst.zpid)
+
+                dirty = bool(score and board.push(lst, score)) or dirty
+
+                if dirty and time.monotonic() - last_publish >= interval:
+                    it.notes.status(f"PROVISIONAL: {board.describe()}")
+                    last_publish = time.monotonic()
+                    dirty = False
+
+                if token_budget is not None and it.usage.prompt_tokens - start_tokens >= token_budget:
+                    reason = f"token budget of {token_budget} exhausted with {len(unscored)} listings unscored"
+                    break
+    except TimeoutError:
+        reason = f"time budget of {deadline}s exhausted with {len(unscored)} listings unscored"
+
+    it.notes.log(f"Stopped ranking: {reason}")
+    it.notes.log(f"Ranking usage: {it.usage.describe()}; {score_cache.stats()}")
+
+    return board.best()
@@ -0,0 +1,205 @@
+
+import asyncio
+from typing import AsyncIterator, Self
+
+import openai
+from openai.types.chat import (ChatCompletionContentPartImageParam,
+                               ChatCompletionContentPartTextParam)
+from pydantic import BaseModel, Field
+
+import metrics
+from data import Listing, Listings
+from interview import Interview
+from oai import Conversation
+from ranker import ListingScore, Ranker
+from scorecache import scores as score_cache
+from textagent import TextAgent
+from tokens import IMAGE_TOKENS
+
+
+class KeyedListingScore(ListingScore):
+    zpid: int = Field(description="The listing ID of the apartment this score is for")
+
+class ListingScores(BaseModel):
+    scores: list[KeyedListingScore] = Field(description="A score for every apartment, each keyed by its listing ID")
+
+class ListingOrder(BaseModel):
+    zpids: list[int] = Field(description="The listing IDs of every apartment, ordered from the one the user would most like to the one they would least like")
+
+
+def brief(lst: Listing) -> str:
+    """
+    A one-paragraph, text-only description of a listing, for pre-ranking.
+    """
+    return (f"Listing ID {lst.zpid}: {lst.bedrooms} bed/{lst.bathrooms} bath for ${lst.price}, "
+            f"{lst.address.street_address}, {lst.zipcode}. {lst.description[:400]}")
+
+
+class BatchRanker(Ranker):
+    """
+    Rates several listings in a single request, rather than one at a time.
+    """
+
+    INSTRUCTIONS = """
+Your interview has now concluded. Your next task is to rate each of the following apartments based on the user's preferences. Each apartment begins with its listing ID, followed by its photos. For every apartment, give reasoning by listing a set of benefits (things the user would like about the apartment) and a set of drawbacks (things the user would dislike about the apartment). Incorporate both of those pieces of reasoning into a final score, which is a floating point number between zero and one hundred. Key each score by the apartment's listing ID.
+"""
+
+    # Listings rated per request
+    BATCH = 8
+    # Photos sent per listing; fewer than when ranking alone, to keep requests small
+    PHOTOS = 4
+    # Most tokens of listings (summaries and photos) per request, so listings with long descriptions go fewer at a time
+    BATCH_TOKENS = 6000
+
+    @classmethod
+    def batches(cls, listings: list[Listing]) -> list[list[Listing]]:
+        """
+        `listings` in order, split into requests of at most `BATCH` listings
+        and (unless a listing is that big alone) `BATCH_TOKENS` tokens.
+        """
+        batches: list[list[Listing]] = []
+        size = 0
+        for lst in listings:
+            cost = lst.summary_tokens() + len(lst.photo_urls(cls.PHOTOS)) * IMAGE_TOKENS
+            if not batches or len(batches[-1]) == cls.BATCH or size + cost > cls.BATCH_TOKENS:
+                batches.append([])
+                size = 0
+            batches[-1].append(lst)
+            size += cost
+        return batches
+
+    @metrics.traced("rank_batch")
+    async def rank_batch(self, lsts: list[Listing]) -> dict[int, ListingScore]:
+        content : list[ChatCompletionContentPartTextParam | ChatCompletionContentPartImageParam] = []
+        for lst in lsts:
+            content.append({"type": "text", "text": f"Listing ID {lst.zpid}:\n{lst.summarize()}"})
+            content.extend(self.images(lst, self.PHOTOS))
+
+        self.user({"role": "user", "content": content}, noteworthy=False)
+
+        try:
+            scores = await self.generate_to_spec(ListingScores, noteworthy=False)
+        except openai.BadRequestError as brq:
+            if brq.code != "invalid_image_url": raise brq
+            # Rank the batch one at a time, so only the listing with the bad image is lost
+            self.notes.log(f"ERROR: invalid image URL in batch {[l.zpid for l in lsts]}, ranking individually")
+            singles = [await Ranker(self.it, self.prefix).rank(lst) for lst in lsts]
+            return {lst.zpid: score for (lst, score) in zip(lsts, singles) if score}
+
+        if not scores:
+            self.notes.log("ERROR: Failed to generate listing scores")
+            return {}
+
+        wanted = {lst.zpid for lst in lsts}
+        found = {score.zpid: ListingScore(**score.model_dump(exclude={'zpid'}))
+                 for score in scores.scores if score.zpid in wanted}
+
+        for (zpid, score) in found.items():
+            self.notes.log(f"{zpid} ({score.final_score}) - Benefits: {score.benefits} | Drawbacks: {score.drawbacks}")
+        if missing := wanted - found.keys():
+            self.notes.log(f"ERROR: No score returned for listings {sorted(missing)}")
+
+        return found
+
+    @classmethod
+    async def stream(cls: type[Self], it: Interview, listings: Listings,
+                     concurrency: int = Ranker.CONCURRENCY, timeout: float | None = Ranker.TIMEOUT,
+                     prefix: Conversation | None = None) -> AsyncIterator[tuple[Listing, ListingScore | None]]:
+        """
+        Like `Ranker.stream`, but rating `BATCH` listings per request.
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        uncached = []
+        for lst in listings.root:
+            if lst.zpid in it.prescored:
+                yield lst, it.prescored[lst.zpid]
+            elif it.fingerprint and (cached := score_cache.get(it.fingerprint, lst.zpid)):
+                yield lst, cached
+            else:
+                uncached.append(lst)
+
+        batches = cls.batches(uncached)
+
+        async def scored(batch: list[Listing]) -> list[tuple[Listing, ListingScore | None]]:
+            scores = await cls.retrying(it, f"batch {[l.zpid for l in batch]}",
+                                        lambda: cls(it, prefix).rank_batch(batch),
+                                        limit, timeout) or {}
+            if it.fingerprint:
+                for (zpid, score) in scores.items():
+                    score_cache.put(it.fingerprint, zpid, score)
+            return [(lst, scores.get(lst.zpid)) for lst in batch]
+
+        tasks = [asyncio.create_task(scored(batch)) for batch in batches]
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for pair in await next_done:
+                    yield pair
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class PreRanker(TextAgent):
+    """
+    Cheaply orders listings from text alone, so that only the most promising
+    need to be rated with their photos.
+    """
+
+    INSTRUCTIONS = """
+Your interview has now concluded. Your next task is to sort the following apartments by how much the user would like them, based on the user's preferences. List every apartment's listing ID exactly once, from the apartment the user would most like to the one they would least like.
+"""
+
+    # Listings sorted per request
+    WINDOW = 25
+
+    def __init__(self, it: Interview, prefix: Conversation | None = None):
+        super().__init__(init=list(it.convo if prefix is None else prefix), model="gpt-4o-mini", notes=it.notes)
+
+        self.system(self.INSTRUCTIONS, noteworthy=False)
+
+    @metrics.traced("pre_rank")
+    async def order(self, lsts: list[Listing]) -> list[int]:
+        self.user({"role": "user", "content": "\n\n".join(map(brief, lsts))}, noteworthy=False)
+
+        order = await self.generate_to_spec(ListingOrder, noteworthy=False)
+        if not order:
+            self.notes.log("ERROR: Failed to pre-rank listings")
+            return []
+        return order.zpids
+
+    @classmethod
+    async def shortlist(cls, it: Interview, listings: Listings, keep: int,
+                        prefix: Conversation | None = None,
+                        concurrency: int = Ranker.CONCURRENCY) -> Listings:
+        """
+        The `keep` listings the pre-ranker thinks most promising. Listings are
+        sorted in windows of `WINDOW`, then merged by their relative position
+        within their window. Windows which can't be sorted, even after
+        retrying, keep their original order.
+        """
+        if len(listings.root) <= keep:
+            return listings
+
+        windows = [listings.root[i:i + cls.WINDOW] for i in range(0, len(listings.root), cls.WINDOW)]
+        limit = asyncio.Semaphore(concurrency)
+
+        async def ordered(window: list[Listing]) -> list[int]:
+            order = await Ranker.retrying(it, f"window {[l.zpid for l in window]}",
+                                          lambda: cls(it, prefix).order(window), limit)
+            return order or [lst.zpid for lst in window]
+
+        orders = await asyncio.gather(*map(ordered, windows))
+
+        position: dict[int, float] = {}
+        for (window, order) in zip(windows, orders):
+            ranks = {zpid: i for (i, zpid) in enumerate(dict.fromkeys(order))}
+            for lst in window:
+                # Listings the model left out go to the back of their window
+                position[lst.zpid] = ranks.get(lst.zpid, len(window)) / len(window)
+
+        best = sorted(listings.root, key=lambda lst: position[lst.zpid])[:keep]
+        it.notes.log(f"Pre-ranked {len(listings.root)} listings, keeping {[l.zpid for l in best]}")
+
+        return Listings.model_construct(root=best)
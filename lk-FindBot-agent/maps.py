@@ -1,21 +1,33 @@
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=".env.local")
 
+import asyncio
 import googlemaps
+import numpy as np
 from data import Listing
-from functools import lru_cache
+from geocache import cache, normalize
+import aio
+import gazetteer
+import metrics
 import logging
+from os import getenv
 
 GMAPS_API_KEY = "<YOUR_VERY_OWN_GMAPS_API>"
 
 gmaps = googlemaps.Client(GMAPS_API_KEY)
 
+# Resolve neighborhoods against the bundled gazetteer instead of Google Maps
+OFFLINE = bool(getenv("FINDBOT_OFFLINE"))
+
+# How close (in degrees) a listing must be to an exact geocoded location
+EPSILON = 0.0001
+
 def includes(geometry, lstng: Listing):
     def between(b1, el, b2):
         if b1 > b2: return between(b2, el, b1)
         return b1 <= el <= b2
 
-    def close(v1, v2, epsilon=0.0001):
+    def close(v1, v2, epsilon=EPSILON):
         return abs(v1 - v2) < epsilon
 
     if geometry['location_type'] == 'APPROXIMATE':
@@ -28,12 +40,57 @@ def includes(geometry, lstng: Listing):
         return (close(loc['lat'], lstng.latitude)
                 and close(loc['lng'], lstng.longitude))
 
-@lru_cache
+def includes_all(geometry, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """
+    A vectorized `includes`: a boolean mask of which of the points (`lat`, `lng`) lie in `geometry`.
+    """
+    if geometry['location_type'] == 'APPROXIMATE':
+        bounds = geometry['bounds']
+        ne, sw = bounds['northeast'], bounds['southwest']
+        lat_lo, lat_hi = sorted((ne['lat'], sw['lat']))
+        lng_lo, lng_hi = sorted((ne['lng'], sw['lng']))
+        return (lat_lo <= lat) & (lat <= lat_hi) & (lng_lo <= lng) & (lng <= lng_hi)
+    else:
+        loc = geometry['location']
+        return (np.abs(loc['lat'] - lat) < EPSILON) & (np.abs(loc['lng'] - lng) < EPSILON)
+
+@metrics.traced("geocode")
 def geocode(loc):
+    codes = cache.get(loc)
+    if codes is not None:
+        metrics.count("geocode_cache", result="hit")
+        return codes
+
+    metrics.count("geocode_cache", result="miss")
+
     codes = gmaps.geocode(loc, components = { "locality": "New York City", "country": "US" })
+    cache.put(loc, codes)
+    logging.info("Geocoded %s; %s", loc, cache.stats())
     if len(codes) == 0:
         logging.warning("Attempted to geocode %s, but found no results", loc)
     elif len(codes) > 2:
         logging.warning(f"Attempted to geocode %s, but found {len(codes)} results", loc)
 
     return codes
+
+def locate(name):
+    """
+    Geocodes a neighborhood name, from the offline gazetteer if `OFFLINE` is set.
+    """
+    return gazetteer.lookup(name) if OFFLINE else geocode(name)
+
+_geocodes = aio.Coalescer("geocode")
+
+async def alocate(name):
+    """
+    `locate`, without blocking the event loop. Concurrent requests for the same
+    place share a single geocode.
+    """
+    if OFFLINE: return gazetteer.lookup(name)
+    return await _geocodes(normalize(name), lambda: aio.run("geocode", geocode, name))
+
+async def warm(names):
+    """
+    Geocodes every one of `names` at once, so that `locate` finds them all cached.
+    """
+    await asyncio.gather(*(alocate(name) for name in names))
@@ -0,0 +1,184 @@
+
+"""
+Tracing spans and counters for the interview-to-recommendation pipeline.
+
+Every span's duration goes into a histogram, and counters and gauges record
+retries, tokens, cache hits and queue depths. Set `FINDBOT_METRICS_PORT` to
+serve them in the Prometheus text format at `/metrics`, and
+`FINDBOT_TRACE_PATH` to also append every finished span to that file as a
+JSON line.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv
+from typing import Callable
+
+# Upper bounds (in seconds) of the span duration histogram's buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+PREFIX = "findbot_"
+
+Labels = tuple[tuple[str, str], ...]
+
+def labelled(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for (k, v) in labels.items()))
+
+def render(name: str, labels: Labels, value: float) -> str:
+    inner = ",".join(f'{k}="{v}"' for (k, v) in labels)
+    return f"{PREFIX}{name}{{{inner}}} {value:g}" if inner else f"{PREFIX}{name} {value:g}"
+
+
+class Registry:
+    """
+    The metrics of this process. Safe to update from any thread.
+    """
+
+    def __init__(self, trace_path: str | None = None):
+        self.lock = threading.Lock()
+        self.counters: defaultdict[tuple[str, Labels], float] = defaultdict(float)
+        # Per span: count of durations at or under each bucket, then the count and sum of all of them
+        self.histograms: dict[tuple[str, Labels], list[float]] = {}
+        self.gauges: dict[tuple[str, Labels], Callable[[], float]] = {}
+        self.trace_path = trace_path
+
+    def count(self, name: str, amount: float = 1, **labels):
+        with self.lock:
+            self.counters[(name, labelled(labels))] += amount
+
+    def gauge(self, name: str, read: Callable[[], float], **labels):
+        """
+        Registers a gauge whose value is read with `read` whenever the metrics are exported.
+        """
+        with self.lock:
+            self.gauges[(name, labelled(labels))] = read
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, labelled(labels))
+        with self.lock:
+            counts = self.histograms.setdefault(key, [0.0] * (len(BUCKETS) + 2))
+            for (i, bound) in enumerate(BUCKETS):
+                if seconds <= bound: counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+
+    def span(self, name: str, **labels) -> "Span":
+        return Span(self, name, labels)
+
+    def traced(self, name: str, **labels):
+        """
+        Wraps a function (or coroutine function) in a span named `name`.
+        """
+        def decorate(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def run(*args, **kwargs):
+                    with self.span(name, **labels):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def run(*args, **kwargs):
+                    with self.span(name, **labels):
+                        return fn(*args, **kwargs)
+            return run
+        return decorate
+
+    def trace(self, record: dict):
+        if not self.trace_path: return
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock, open(self.trace_path, "a") as file:
+            file.write(line)
+
+    def prometheus(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(render(f"{name}_total", labels, value))
+        for (name, labels), read in gauges:
+            try:
+                lines.append(render(name, labels, read()))
+            except Exception:
+                logging.exception("Failed to read gauge %s", name)
+        for (name, labels), counts in histograms:
+            for (bound, count) in zip(BUCKETS, counts):
+                lines.append(render("span_seconds_bucket", (("span", name), *labels, ("le", f"{bound:g}")), count))
+            lines.append(render("span_seconds_bucket", (("span", name), *labels, ("le", "+Inf")), counts[-2]))
+            lines.append(render("span_seconds_count", (("span", name), *labels), counts[-2]))
+            lines.append(render("span_seconds_sum", (("span", name), *labels), counts[-1]))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """
+        Serves the metrics in the Prometheus text format on `port`, from a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format, *args)
+
+        server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logging.info("Serving metrics on port %d", port)
+        return server
+
+
+class Span:
+    """
+    A timed stage of the pipeline. Use it as a context manager, or call `end`
+    yourself when the stage doesn't finish in the block that started it.
+    """
+
+    def __init__(self, registry: Registry, name: str, labels: dict):
+        self.registry, self.name, self.labels = registry, name, labels
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.ended = False
+
+    def end(self, error: BaseException | None = None):
+        if self.ended: return
+        self.ended = True
+
+        seconds = time.perf_counter() - self.started
+        self.registry.observe(self.name, seconds, **self.labels)
+        if error is not None:
+            self.registry.count("span_errors", span=self.name, error=type(error).__name__)
+
+        self.registry.trace({"span": self.name, **self.labels, "start": self.start, "seconds": seconds,
+                             "pid": os.getpid(), "error": None if error is None else repr(error)})
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.end(error)
+
+
+registry = Registry(trace_path=getenv("FINDBOT_TRACE_PATH"))
+
+# Where to serve Prometheus metrics from, if anywhere
+PORT = int(getenv("FINDBOT_METRICS_PORT") or 0) or None
+
+count, gauge, observe, span, traced = registry.count, registry.gauge, registry.observe, registry.span, registry.traced
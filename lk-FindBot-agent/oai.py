@@ -1,7 +1,83 @@
 
+import functools
+from contextvars import ContextVar
+from dataclasses import dataclass
+
 import openai
 from openai.types.chat import ChatCompletionMessageParam
 
+import metrics
+from tokens import IMAGE_TOKENS, estimate_tokens
+
 
-client = openai.AsyncOpenAI()
 Conversation = list[ChatCompletionMessageParam]
+
+def conversation_tokens(convo: Conversation) -> int:
+    total = 0
+    for msg in convo:
+        content = msg.get('content') or []
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                total += estimate_tokens(part['text'])
+            elif part.get('type') == 'image_url':
+                total += IMAGE_TOKENS
+    return total
+
+@dataclass
+class Usage:
+    """
+    Token usage of an interview's LLM requests, as reported in OpenAI's responses.
+    """
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def record(self, prompt_tokens: int, cached_tokens: int = 0):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+
+    def describe(self) -> str:
+        rate = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (f"{self.requests} requests, {self.prompt_tokens} prompt tokens, "
+                f"{self.cached_tokens} cached ({rate:.0%})")
+
+# Where the usage of requests made from the current task is recorded, if anywhere
+current_usage: ContextVar[Usage | None] = ContextVar("current_usage", default=None)
+
+def measured(call):
+    @functools.wraps(call)
+    async def run(*args, **kwargs):
+        response = await call(*args, **kwargs)
+
+        # Streamed responses don't carry usage
+        if (usage := getattr(response, "usage", None)) is not None:
+            details = usage.prompt_tokens_details
+            cached = (details.cached_tokens or 0) if details is not None else 0
+
+            metrics.count("llm_requests")
+            metrics.count("prompt_tokens", usage.prompt_tokens)
+            metrics.count("cached_tokens", cached)
+            if (current := current_usage.get()) is not None:
+                current.record(usage.prompt_tokens, cached)
+
+        return response
+    return run
+
+def measure(client):
+    """
+    Wraps `client`'s chat completion calls to record the usage reported by
+    every successful response in `current_usage`. Failed and retried
+    requests aren't counted.
+    """
+    resources = {id(r): r for r in (client.chat.completions, client.beta.chat.completions)}
+    for resource in resources.values():
+        for name in ("create", "parse"):
+            if hasattr(resource, name):
+                setattr(resource, name, measured(getattr(resource, name)))
+    return client
+
+client = measure(openai.AsyncOpenAI())
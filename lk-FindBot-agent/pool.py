@@ -0,0 +1,122 @@
+
+import logging
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.synchronize import Event
+from typing import Callable
+
+# Workers are started by a fork server: a fresh, single-threaded process which imports the main module
+# (and so loads the dataset and builds the search indexes) once, then forks every worker from itself, so
+# they all share one copy. Forking this process instead would copy any locks its other threads (the notes
+# writer, the thread pools) happened to be holding.
+context = mp.get_context("forkserver")
+context.set_forkserver_preload(["__main__"])
+
+WorkerTarget = Callable[[int, Event, Synchronized], None]
+
+class Slot:
+    """
+    One place in the pool, and the process currently filling it.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: mp.Process | None = None
+        # When the worker last proved its event loop was running, as a Unix time
+        self.heartbeat: Synchronized = context.Value('d', 0.0)
+        self.restarts = 0
+        self.started = 0.0
+        self.next_start = 0.0
+
+class WorkerPool:
+    """
+    A supervised pool of worker processes, each running `target(index,
+    stopping, heartbeat)`. Workers are expected to update `heartbeat` every
+    `HEARTBEAT` seconds; any that exit or fall silent are restarted, backing
+    off if they keep failing. `drain` asks every worker to finish its current
+    work and stop, via `stopping`.
+    """
+
+    # Seconds between heartbeats, and between the supervisor's checks
+    HEARTBEAT = 5.0
+    # Seconds without a heartbeat before a worker is assumed hung
+    HEALTH_TIMEOUT = 120.0
+    # Longest wait (seconds) before restarting a worker that keeps dying
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, size: int, target: WorkerTarget, on_exit: Callable[[int], None] = lambda pid: None):
+        self.size = size
+        self.target = target
+        # Called with the pid of every worker which exits or is killed, to clean up after it
+        self.on_exit = on_exit
+        self.stopping = context.Event()
+        self.slots = [Slot(i) for i in range(size)]
+        self.supervisor = threading.Thread(target=self.supervise, name="pool-supervisor", daemon=True)
+
+    def start(self):
+        for slot in self.slots:
+            self.spawn(slot)
+        self.supervisor.start()
+
+    def spawn(self, slot: Slot):
+        slot.heartbeat.value = time.time()
+        slot.started = time.monotonic()
+        slot.process = context.Process(target=self.target, args=(slot.index, self.stopping, slot.heartbeat),
+                                       name=f"findbot-worker-{slot.index}")
+        slot.process.start()
+        logging.info("Started worker %d (pid %d)", slot.index, slot.process.pid)
+
+    def check(self, slot: Slot):
+        if self.stopping.is_set(): return
+
+        process = slot.process
+        if process is None:
+            if time.monotonic() >= slot.next_start: self.spawn(slot)
+            return
+
+        if process.exitcode is None:
+            silent = time.time() - slot.heartbeat.value
+            if silent < self.HEALTH_TIMEOUT: return
+            logging.error("Worker %d (pid %d) missed heartbeats for %.0fs, killing it", slot.index, process.pid, silent)
+            process.kill()
+            process.join()
+        else:
+            logging.error("Worker %d (pid %d) exited with code %s", slot.index, process.pid, process.exitcode)
+
+        self.on_exit(process.pid)
+        slot.process = None
+        # A worker that stayed up a good while before dying starts its backoff afresh
+        slot.restarts = 1 if time.monotonic() - slot.started > self.HEALTH_TIMEOUT else slot.restarts + 1
+        # Restart at once the first time, then back off while it keeps dying
+        slot.next_start = time.monotonic() + min(self.MAX_BACKOFF, self.HEARTBEAT * (2 ** slot.restarts - 2))
+
+    def supervise(self):
+        while not self.stopping.wait(self.HEARTBEAT):
+            for slot in self.slots:
+                try:
+                    self.check(slot)
+                except Exception:
+                    logging.exception("Failed to check on worker %d", slot.index)
+
+    def alive(self) -> int:
+        return sum(1 for slot in self.slots if slot.process is not None and slot.process.is_alive())
+
+    def drain(self, timeout: float | None = None):
+        """
+        Stops handing out work and waits up to `timeout` seconds for every
+        worker to finish what it has, then kills any that are left.
+        """
+        self.stopping.set()
+        if self.supervisor.is_alive(): self.supervisor.join()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        for slot in self.slots:
+            if slot.process is None: continue
+            slot.process.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if slot.process.exitcode is None:
+                logging.warning("Worker %d (pid %d) did not drain in time, killing it", slot.index, slot.process.pid)
+                slot.process.kill()
+                slot.process.join()
+            self.on_exit(slot.process.pid)
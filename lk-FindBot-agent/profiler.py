@@ -0,0 +1,59 @@
+
+from pydantic import BaseModel, Field
+
+from interview import Interview
+from oai import Conversation
+from textagent import TextAgent
+
+
+class Preferences(BaseModel):
+    summary: str = Field(description="A short paragraph describing the user and what they want from an apartment, including anything they value beyond search constraints.")
+    must_haves: list[str] = Field(description="Things the apartment must have, each five words or fewer.")
+    nice_to_haves: list[str] = Field(description="Things the user would like but could live without, each five words or fewer.")
+    dealbreakers: list[str] = Field(description="Things which would rule an apartment out, each five words or fewer.")
+
+    def describe(self) -> str:
+        nl = '\n'
+        return f"""
+        The user's apartment preferences, as gathered in an interview:
+        {self.summary}
+        Must haves:
+        {nl.join('- ' + item for item in self.must_haves)}
+        Nice to haves:
+        {nl.join('- ' + item for item in self.nice_to_haves)}
+        Dealbreakers:
+        {nl.join('- ' + item for item in self.dealbreakers)}
+        """
+
+
+class Profiler(TextAgent):
+    INSTRUCTIONS = """
+Your interview has now concluded. Your next task is to distill the conversation into a profile of the user's preferences in an apartment. Another agent will rate apartments using only this profile, so include everything from the interview which could make the user like or dislike an apartment.
+"""
+
+    def __init__(self, it: Interview):
+        super().__init__(init=it.convo, model="gpt-4o-mini", notes=it.notes)
+
+        self.system(self.INSTRUCTIONS, noteworthy=False)
+
+    async def profile(self) -> Preferences | None:
+        prefs = await self.generate_to_spec(Preferences, noteworthy=False)
+
+        if not prefs:
+            self.notes.log("ERROR: Failed to generate preference profile")
+            return None
+
+        self.notes.log(f"Preference profile: {prefs.describe()}")
+        return prefs
+
+    @classmethod
+    async def condensed(cls, it: Interview) -> Conversation:
+        """
+        A replacement for the interview's conversation holding only the user's
+        distilled preferences, or the full conversation if distilling fails.
+        The preferences themselves are kept as the interview's `profile`.
+        """
+        it.profile = await cls(it).profile()
+        if it.profile is None:
+            return it.convo
+        return [{"role": "system", "content": it.profile.describe()}]
@@ -3,9 +3,12 @@ from typing import Self
 
 from pydantic import BaseModel, Field
 
-from data import Listing, Listings
+import metrics
+from data import Dataset, Listing, Listings
 from interview import Interview
-from maps import geocode, includes
+from maps import includes, locate, warm
+from relax import fit
+from search import IncrementalSearch
 from textagent import TextAgent
 
 
@@ -44,7 +47,7 @@ class ApartmentQuery(BaseModel):
         well_placed = (self.neighborhoods is None
                        or any(includes(loc['geometry'], lst)
                               for hood in self.neighborhoods
-                              for loc in geocode(hood.name)))
+                              for loc in locate(hood.name)))
 
         return well_priced and well_fit and well_placed
 
@@ -58,8 +61,12 @@ Your interview has now concluded. Your next task is to generate a set of constra
     def __init__(self, it: Interview):
         super().__init__(init=it.convo, notes=it.notes)
 
+        # The query behind the latest search
+        self.last_query: ApartmentQuery | None = None
+
         self.system(self.INSTRUCTIONS)
 
+    @metrics.traced("write_query")
     async def write_query(self) -> ApartmentQuery:
         parse = await self.generate_to_spec(ApartmentQuery)
 
@@ -70,28 +77,49 @@ Your interview has now concluded. Your next task is to generate a set of constra
 
         return parse
 
-    def search_dataset(self, dataset: Listings, query: ApartmentQuery) -> Listings:
-        return Listings([l for l in dataset.root if query.matches(l) ])
-
-    async def query(self, dataset: Listings, retries=5, min=5, max=100) -> Listings:
+    async def query(self, dataset: Dataset | Listings, retries=5, min=5, max=100,
+                    draft: ApartmentQuery | None = None) -> Listings:
+        """
+        Searches `dataset` for between `min` and `max` listings, trying `draft`
+        as the first query if given.
+        """
 
         if self.notes:
             self.notes.status("Query is begin generated.")
 
-        for i in range(retries):
-            qry = await self.write_query()
-            res = self.search_dataset(dataset, qry)
+        search = IncrementalSearch(dataset)
 
-            if min <= len(res.root) <= max:
-                if self.notes: self.notes.status(f"Query Generated: {len(res.root)} apartments found")
-                return res
-            elif min > len(res.root):
-                self.system("This query is too tight - it restricts the set of available apartments too heavily. Try again.")
-            elif max < len(res.root):
-                self.system("This query is too loose - it doesn't restrict the set of available apartments enough. Try again.")
+        for i in range(retries):
+            qry = self.last_query = draft if i == 0 and draft is not None else await self.write_query()
+            # Geocoded concurrently and off the event loop, so the search itself finds them cached
+            await warm(hood.name for hood in qry.neighborhoods or [])
+            found = len(search.search(qry))
+
+            metrics.count("query_attempts", outcome="fit" if min <= found <= max else "tight" if found < min else "loose")
+
+            if min <= found <= max:
+                if self.notes: self.notes.status(f"Query Generated: {found} apartments found")
+                return search.listings()
+            elif min > found:
+                self.system(f"This query is too tight - it restricts the set of available apartments too heavily. We need between {min} and {max} matches. Search results: {search.feedback()}. Try again.")
+            elif max < found:
+                self.system(f"This query is too loose - it doesn't restrict the set of available apartments enough. We need between {min} and {max} matches. Search results: {search.feedback()}. Try again.")
+
+        # With no retries there is no query yet, so write one to adjust
+        if search.query is None:
+            qry = self.last_query = draft if draft is not None else await self.write_query()
+            await warm(hood.name for hood in qry.neighborhoods or [])
+            search.search(qry)
+
+        # Fall back to adjusting the last query ourselves
+        metrics.count("query_fallbacks")
+        fitted = fit(search, min, max)
+        if fitted != search.query:
+            search.search(fitted)
+        qry = self.last_query = search.query
 
         if self.notes:
             self.notes.log(
-                f"Failed to find an appropraite apartment set after {retries} tries, returning {len(res.root)} entries")
+                f"Failed to find an appropriate apartment set after {retries} tries, adjusted the last query to {qry.model_dump_json()}, returning {len(search.rows)} entries")
 
-        return res
+        return search.listings()
@@ -1,20 +1,30 @@
 
+import asyncio
 import heapq
+import random
+from contextlib import aclosing
 from functools import lru_cache
-from typing import Self
+from os import getenv
+from typing import AsyncIterator, Awaitable, Callable, Self, TypeVar
 
 import openai
 from openai.types.chat import (ChatCompletionContentPartImageParam,
                                ChatCompletionContentPartTextParam,
                                ChatCompletionUserMessageParam)
-from pydantic import AnyUrl, BaseModel, Field
+from pydantic import BaseModel, Field
 
-from data import Listing, Listings, Photo
+import metrics
+from data import Listing, Listings
 from interview import Interview
+from oai import Conversation, current_usage
+from profiler import Preferences, Profiler
+from scorecache import scores as score_cache
 from sheets import Notes
 from textagent import TextAgent
 
 
+T = TypeVar('T')
+
 class ListingScore(BaseModel):
     benefits : list[str] = Field(description="Things the user would like about this apartment, each five words or fewer.")
     drawbacks : list[str] = Field(description="Things the user would dislike about this apartment, each five words or fewer.")
@@ -26,25 +36,58 @@ class Ranker(TextAgent):
 Your interview has now concluded. Your next task is to rate the following apartment based on the user's preferences. You should give reasoning by listing a set of benefits (things the user would like about the apartment) and a set of drawbacks (things the user would dislike about the apartment). Incorporate both of those pieces of reasoning into a final score, which is a floating point number between zero and one hundred.
 """
 
-    def __init__(self, it: Interview):
-        super().__init__(init=it.convo, model="gpt-4o-mini", notes=it.notes)
+    # Concurrent requests in flight per interview; 1 restores one-at-a-time ranking
+    CONCURRENCY = 16
+    # Seconds allowed for a single listing's request before it is retried
+    TIMEOUT = 60.0
+    RETRIES = 5
+    # Base delay (seconds) for exponential backoff on 429s and timeouts
+    BACKOFF = 1.0
+    # Rank against a preference profile distilled from the interview, rather than the whole interview.
+    # Shared scores are keyed on that profile, so the score cache needs it too
+    CONDENSE = bool(getenv("FINDBOT_CONDENSE_PROFILE")) or score_cache.enabled
 
-        self.system(self.INSTRUCTIONS, noteworthy=False)
+    def __init__(self, it: Interview, prefix: Conversation | None = None):
+        self.it, self.prefix = it, prefix
 
-    async def rank(self, lst: Listing) -> ListingScore | None:
-        def good_photo(photo: Photo) -> AnyUrl | None:
-            links = photo.mixedSources.jpeg
+        # Every listing's request starts with the same messages, so OpenAI can serve them from its prompt cache
+        super().__init__(init=list(it.convo if prefix is None else prefix), model="gpt-4o-mini", notes=it.notes)
+
+        self.system(self.INSTRUCTIONS, noteworthy=False)
 
-            best = min(links, key=lambda l: abs(450 - l.width), default=None)
-            return None if best is None else best.url
+    @classmethod
+    async def shared_prefix(cls, it: Interview, condense: bool | None = None) -> Conversation:
+        """
+        The conversation every listing's request for `it` begins with. It is
+        worked out once per interview, so the score cache's fingerprint and the
+        requests agree on it.
+        """
+        condense = cls.CONDENSE if condense is None else condense
+        if condense not in it.prefixes:
+            it.prefixes[condense] = await Profiler.condensed(it) if condense else it.convo
+        return it.prefixes[condense]
 
-        images : list[ChatCompletionContentPartTextParam | ChatCompletionContentPartImageParam] = [
+    @classmethod
+    async def preferences(cls, it: Interview) -> Preferences | Conversation:
+        """
+        What listings for `it` are scored against, to fingerprint: the profile
+        distilled from it when ranking against one, otherwise the interview.
+        """
+        await cls.shared_prefix(it)
+        return it.profile if cls.CONDENSE and it.profile is not None else it.convo
+
+    @staticmethod
+    def images(lst: Listing, count: int = 10) -> list[ChatCompletionContentPartTextParam | ChatCompletionContentPartImageParam]:
+        return [
             {"type": "image_url",
-             "image_url": {"url": str(good_photo(photo)), "detail": "low"}}
-            for photo in lst.photos[:10]
-            if good_photo(photo) is not None
+             "image_url": {"url": url, "detail": "low"}}
+            for url in lst.photo_urls(count)
         ]
 
+    @metrics.traced("rank")
+    async def rank(self, lst: Listing) -> ListingScore | None:
+        images = self.images(lst)
+
         text : list[ChatCompletionContentPartTextParam | ChatCompletionContentPartImageParam] = [
             { "type": "text",
               "text": lst.summarize() }
@@ -73,17 +116,88 @@ Your interview has now concluded. Your next task is to rate the following apartm
         return score
 
     @classmethod
-    async def rank_all(cls: type[Self], it: Interview, listings: Listings) -> list[tuple[Listing, ListingScore]]:
+    async def retrying(cls, it: Interview, what: str, request: Callable[[], Awaitable[T]],
+                       limit: asyncio.Semaphore, timeout: float | None = TIMEOUT,
+                       retries: int = RETRIES) -> T | None:
+        """
+        Runs `request` under `limit`, retrying with backoff when it is rate
+        limited or times out. The usage OpenAI reports for it is recorded in
+        `it.usage`.
+        """
+        for attempt in range(retries):
+            try:
+                async with limit:
+                    scope = current_usage.set(it.usage)
+                    try:
+                        return await asyncio.wait_for(request(), timeout)
+                    finally:
+                        current_usage.reset(scope)
+            except openai.RateLimitError as rle:
+                retry_after = rle.response.headers.get("retry-after")
+                delay = float(retry_after) if retry_after else cls.BACKOFF * 2 ** attempt
+                metrics.count("rank_retries", reason="rate_limited")
+                it.notes.log(f"Rate limited while ranking {what}, retrying in {delay:.1f}s")
+            except TimeoutError:
+                delay = cls.BACKOFF * 2 ** attempt
+                metrics.count("rank_retries", reason="timeout")
+                it.notes.log(f"Timed out ranking {what} after {timeout}s, retrying in {delay:.1f}s")
+
+            await asyncio.sleep(delay + random.uniform(0, cls.BACKOFF))
+
+        it.notes.log(f"ERROR: Gave up ranking {what} after {retries} attempts")
+        metrics.count("rank_failures")
+        return None
+
+    @classmethod
+    async def rank_with_retry(cls: type[Self], it: Interview, lst: Listing, limit: asyncio.Semaphore,
+                              timeout: float | None = TIMEOUT, retries: int = RETRIES,
+                              prefix: Conversation | None = None) -> ListingScore | None:
+        if lst.zpid in it.prescored:
+            return it.prescored[lst.zpid]
+        if it.fingerprint and (cached := score_cache.get(it.fingerprint, lst.zpid)):
+            return cached
+
+        score = await cls.retrying(it, str(lst.zpid), lambda: cls(it, prefix).rank(lst), limit, timeout, retries)
+
+        if it.fingerprint and score:
+            score_cache.put(it.fingerprint, lst.zpid, score)
+        return score
+
+    @classmethod
+    async def stream(cls: type[Self], it: Interview, listings: Listings,
+                     concurrency: int = CONCURRENCY, timeout: float | None = TIMEOUT,
+                     prefix: Conversation | None = None) -> AsyncIterator[tuple[Listing, ListingScore | None]]:
+        """
+        Yields each listing with its score (or None if it could not be ranked) as
+        soon as it finishes. Closing the iterator early cancels every request
+        still waiting or in flight.
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def scored(listing: Listing) -> tuple[Listing, ListingScore | None]:
+            return listing, await cls.rank_with_retry(it, listing, limit, timeout, prefix=prefix)
+
+        tasks = [asyncio.create_task(scored(listing)) for listing in listings.root]
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks: task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @classmethod
+    async def rank_all(cls: type[Self], it: Interview, listings: Listings,
+                       concurrency: int = CONCURRENCY, timeout: float | None = TIMEOUT) -> list[tuple[Listing, ListingScore]]:
         it.notes.status("Started Ranking")
 
-        res = []
+        prefix = await cls.shared_prefix(it)
 
-        for listing in listings.root:
-            ranker = cls(it)
-            rnk = await ranker.rank(listing)
-            if rnk: res.append((listing, rnk))
+        async with aclosing(cls.stream(it, listings, concurrency, timeout, prefix)) as scores:
+            ranked = [(listing, rnk) async for (listing, rnk) in scores if rnk]
 
-        return res
+        it.notes.log(f"Ranking usage: {it.usage.describe()}; {score_cache.stats()}")
+        return ranked
 
     @classmethod
     async def top(cls, it: Interview, listings: Listings, count=5) -> list[tuple[Listing, ListingScore]]:
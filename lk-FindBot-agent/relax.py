@@ -0,0 +1,111 @@
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Sequence
+
+import numpy as np
+
+from index import ListingIndex
+
+if TYPE_CHECKING:
+    from programmer import ApartmentQuery
+    from search import IncrementalSearch
+
+
+@dataclass
+class Knob:
+    """
+    One way of loosening or tightening a query: setting `field` to each of
+    `values` in turn moves the match count steadily in one direction.
+    `cost` says how far from the original query a value strays.
+    """
+    field: str
+    values: Sequence[Any]
+    cost: Callable[[Any], float]
+
+
+def knobs(index: ListingIndex, query: "ApartmentQuery", loosen: bool) -> list[Knob]:
+    # Whole-dollar bounds which each just admit (or just exclude) some listing
+    ceilings = np.unique(np.ceil(index.price)).astype(int).tolist()
+    floors = np.unique(np.floor(index.price)).astype(int).tolist()
+    low_rent, high_rent = query.minimum_rent, query.maximum_rent or None
+
+    def rent_cost(old: int | None):
+        # Relative to the rent the user named, or the other bound if they named none
+        return lambda new: abs(new - (old or 0)) / max(old or 0, high_rent or 0, low_rent, 1)
+
+    def room_cost(old: int):
+        return lambda new: 0.25 * abs(new - old)
+
+    if loosen:
+        found = [
+            Knob("maximum_rent", [p for p in ceilings if p > high_rent] if high_rent else [], rent_cost(high_rent)),
+            Knob("minimum_rent", [p for p in reversed(floors) if p < low_rent] if low_rent > 0 else [], rent_cost(low_rent)),
+            Knob("minimum_bedrooms", range(query.minimum_bedrooms - 1, -1, -1), room_cost(query.minimum_bedrooms)),
+            Knob("minimum_bathrooms", range(query.minimum_bathrooms - 1, -1, -1), room_cost(query.minimum_bathrooms)),
+        ]
+        if query.neighborhoods is not None:
+            found.append(Knob("neighborhoods", [None], lambda _: 1.0))
+    else:
+        found = [
+            Knob("maximum_rent", [p - 1 for p in reversed(ceilings) if 0 < p - 1 < (high_rent or np.inf)], rent_cost(high_rent)),
+            Knob("minimum_rent", [p + 1 for p in floors if p + 1 > low_rent], rent_cost(low_rent)),
+            Knob("minimum_bedrooms", range(query.minimum_bedrooms + 1, int(index.bedrooms.max(initial=0)) + 1), room_cost(query.minimum_bedrooms)),
+            Knob("minimum_bathrooms", range(query.minimum_bathrooms + 1, int(index.bathrooms.max(initial=0)) + 1), room_cost(query.minimum_bathrooms)),
+        ]
+
+    return [knob for knob in found if len(knob.values) > 0]
+
+
+def first(values: Sequence[Any], ok: Callable[[Any], bool]) -> int | None:
+    """
+    The position of the first of `values` for which `ok` holds, given that
+    once it holds it keeps holding.
+    """
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ok(values[mid]): hi = mid
+        else: lo = mid + 1
+    return lo if lo < len(values) else None
+
+
+def fit(search: "IncrementalSearch", low: int, high: int, rounds: int = 4) -> "ApartmentQuery":
+    """
+    The query closest to `search`'s current one which matches between `low`
+    and `high` listings, found by loosening or tightening one constraint at a
+    time. If no such query is found within `rounds` adjustments, the closest
+    attempt is returned instead.
+
+    Every value a knob is tried at narrows some query whose matches are
+    already known: the current query when tightening, or the knob's loosest
+    value (searched once) when loosening. So each step of the binary search
+    only filters those matches, rather than searching the whole index.
+    """
+    index, query, rows = search.index, search.query, search.rows
+
+    for _ in range(rounds):
+        if low <= len(rows) <= high:
+            return query
+
+        loosen = len(rows) < low
+        enough = (lambda c: c >= low) if loosen else (lambda c: c <= high)
+
+        options = []
+        for knob in knobs(index, query, loosen):
+            # Every value keeps the neighborhoods of `base`, so only rent and rooms need checking
+            base = index.select(query.model_copy(update={knob.field: knob.values[-1]})) if loosen else rows
+            matching = lambda v: index.fits(base, query.model_copy(update={knob.field: v}))
+
+            at = first(knob.values, lambda v: enough(np.count_nonzero(matching(v))))
+            # A knob that can't reach the band alone is still worth turning all the way
+            value = knob.values[-1] if at is None else knob.values[at]
+            hits = base[matching(value)]
+            options.append((not (low <= len(hits) <= high), at is None, knob.cost(value),
+                            query.model_copy(update={knob.field: value}), hits))
+
+        if not options:
+            break
+
+        (*_, query, rows) = min(options, key=lambda option: option[:3])
+
+    return query
@@ -0,0 +1,323 @@
+
+"""
+A BM25 index over the text of every listing (its description, property
+values and nearby schools), for ordering candidates by how well they match
+the soft preferences from an interview before any of them are ranked.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from os import getenv
+from typing import Iterable, Self
+
+import numpy as np
+
+from data import Dataset, Listing, Listings, ListingView
+from oai import Conversation
+
+# BM25's term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+# Bumped whenever tokenizing, scoring or the file's layout changes, so older index files are rebuilt
+INDEX_VERSION = 2
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but
+by can could did do does doing don down during each few for from further get got had has have having he her here
+hers him his how i if in into is it its just know like ll me mean more most my no nor not now of off oh okay ok on
+once only or other our out over own re really s same she should so some something such t than that the their them
+then there these they thing think this those through to too um uh under until up us very want was we well were
+what when where which while who whom why will with would yeah yes you your yours
+""".split())
+
+def tokens(text: str) -> list[str]:
+    words = re.findall(r"[a-z0-9]+", text.casefold())
+    # Plurals are folded into their singulars, so "pets" matches "pet"
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+            for w in words if len(w) > 1 and w not in STOPWORDS]
+
+def document(lst: Listing | ListingView) -> str:
+    """
+    The searchable text of a listing.
+    """
+    if isinstance(lst, ListingView):
+        record = lst.record
+        values = [v for prop in record["property"] for v in prop["values"]]
+        schools = [(s["name"], s["type"], s["level"], s.get("rating")) for s in record["schools"]]
+        description = record["description"]
+    else:
+        values = [v for prop in lst.properties for v in prop.values]
+        schools = [(s.name, s.type, s.level, s.rating) for s in lst.schools]
+        description = lst.description
+
+    text = [description, *values]
+    for (name, kind, level, rating) in schools:
+        text.append(f"{name} {kind} {level} school")
+        if rating is not None and rating >= 8:
+            text.append("good highly rated school")
+    return "\n".join(text)
+
+def preferences(convo: Conversation) -> str:
+    """
+    Everything the user said in an interview, which is where their soft preferences are.
+    """
+    said = []
+    for msg in convo:
+        if msg['role'] != 'user': continue
+        content = msg.get('content') or []
+        if isinstance(content, str):
+            said.append(content)
+        else:
+            said.extend(part['text'] for part in content if part.get('type') == 'text')
+    return "\n".join(said)
+
+
+class TextIndex:
+    """
+    An inverted index with precomputed BM25 weights: for each term, the rows
+    containing it (ascending) and the weight of the term in each of them.
+    """
+
+    # Indexes already loaded, keyed by the identity of their dataset
+    _built: dict[int, tuple[Dataset | Listings, "TextIndex"]] = {}
+    # How many of them to keep, so replaced versions of a dataset can be freed
+    KEEP = 4
+    # Indexes are built on a dataset reload's thread while jobs look up theirs
+    _lock = threading.Lock()
+
+    def __init__(self, version: str, zpids: np.ndarray, vocabulary: list[str],
+                 offsets: np.ndarray, rows: np.ndarray, counts: np.ndarray, lengths: np.ndarray):
+        self.version = version
+        self.zpids = zpids
+        self.vocabulary = vocabulary
+        self.terms = {term: i for (i, term) in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.rows = rows
+        # How often each posting's term appears in its listing, and how many terms each listing has
+        self.counts = counts
+        self.lengths = lengths
+        self.weights = self.weigh()
+        # For finding the rows of listings by zpid
+        self.by_zpid = np.argsort(zpids, kind='stable')
+
+    def weigh(self) -> np.ndarray:
+        count = len(self.lengths)
+        if count == 0: return np.empty(0, dtype=np.float32)
+
+        frequency = np.diff(self.offsets)
+        idf = np.log1p((count - frequency + 0.5) / (frequency + 0.5)).astype(np.float32)
+        norm = K1 * (1 - B + B * self.lengths / max(self.lengths.mean(), 1.0))
+        weights = np.repeat(idf, frequency) * self.counts * (K1 + 1) / (self.counts + norm[self.rows])
+        return weights.astype(np.float32)
+
+    @staticmethod
+    def tally(listings: Iterable[tuple[int, Listing | ListingView]], vocabulary: dict[str, int]):
+        """
+        The terms, rows and counts of the postings of `listings` (each with its
+        row), and their zpids and lengths, adding any new terms to `vocabulary`.
+        """
+        term_ids = [np.empty(0, dtype=np.int32)]
+        rows = [np.empty(0, dtype=np.int32)]
+        counts = [np.empty(0, dtype=np.float32)]
+        zpids, lengths = [], []
+
+        for (row, lst) in listings:
+            words = tokens(document(lst))
+            tally = Counter(vocabulary.setdefault(w, len(vocabulary)) for w in words)
+            term_ids.append(np.fromiter(tally.keys(), dtype=np.int32, count=len(tally)))
+            counts.append(np.fromiter(tally.values(), dtype=np.float32, count=len(tally)))
+            rows.append(np.full(len(tally), row, dtype=np.int32))
+            lengths.append(len(words))
+            zpids.append(lst.zpid)
+
+        return (np.concatenate(term_ids), np.concatenate(rows), np.concatenate(counts),
+                np.asarray(zpids, dtype=np.int64), np.asarray(lengths, dtype=np.float32))
+
+    @classmethod
+    def assemble(cls, version: str, zpids: np.ndarray, vocabulary: list[str], term_ids: np.ndarray,
+                 rows: np.ndarray, counts: np.ndarray, lengths: np.ndarray) -> Self:
+        # Terms no listing has any more are dropped
+        frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        used = frequency > 0
+        if not used.all():
+            term_ids = (np.cumsum(used) - 1).astype(np.int32)[term_ids]
+            vocabulary = [term for (term, use) in zip(vocabulary, used) if use]
+            frequency = frequency[used]
+
+        # Grouped by term, each term's rows ascending
+        order = np.lexsort((rows, term_ids))
+        offsets = np.concatenate(([0], np.cumsum(frequency))).astype(np.int64)
+        return cls(version, zpids, vocabulary, offsets, rows[order], counts[order], lengths)
+
+    @classmethod
+    def build(cls, version: str, listings: Iterable[Listing | ListingView]) -> Self:
+        vocabulary: dict[str, int] = {}
+        (term_ids, rows, counts, zpids, lengths) = cls.tally(enumerate(listings), vocabulary)
+        return cls.assemble(version, zpids, list(vocabulary), term_ids, rows, counts, lengths)
+
+    def updated(self, version: str, zpids: np.ndarray, kept: np.ndarray,
+                changes: list[tuple[int, Listing]]) -> "TextIndex":
+        """
+        This index with only rows `kept` (closing up the gaps between them),
+        then `changes` (rows and listings) written over or after them, as
+        `ingest.apply` does to a dataset whose zpids are then `zpids`. Only the
+        changed listings are tokenized, though every weight is worked out
+        again, as they all depend on the number and lengths of the listings.
+        """
+        changed = np.fromiter((row for (row, _) in changes), dtype=np.int64, count=len(changes))
+
+        moved = np.full(len(self), -1, dtype=np.int32)
+        moved[kept] = np.arange(len(kept), dtype=np.int32)
+        stale = np.zeros(len(zpids), dtype=bool)
+        stale[changed] = True
+
+        rows = moved[self.rows]
+        keep = rows >= 0
+        keep[keep] = ~stale[rows[keep]]
+        term_ids = np.repeat(np.arange(len(self.vocabulary), dtype=np.int32), np.diff(self.offsets))
+
+        vocabulary = dict(self.terms)
+        (new_terms, new_rows, new_counts, _, new_lengths) = self.tally(changes, vocabulary)
+
+        lengths = np.zeros(len(zpids), dtype=np.float32)
+        lengths[:len(kept)] = self.lengths[kept]
+        lengths[changed] = new_lengths
+
+        return self.assemble(version, zpids, list(vocabulary), np.concatenate((term_ids[keep], new_terms)),
+                             np.concatenate((rows[keep], new_rows)),
+                             np.concatenate((self.counts[keep], new_counts)), lengths)
+
+    @staticmethod
+    def path(snapshot: str, version: str) -> str:
+        """
+        Where the index of version `version` of the snapshot at `snapshot` is
+        kept. Each version has its own file, so building an old version's late
+        can't overwrite a newer one's.
+        """
+        return f"{snapshot}.{hashlib.blake2b(version.encode(), digest_size=8).hexdigest()}.bm25.npz"
+
+    @classmethod
+    def prune(cls, snapshot: str, keep: Iterable[str]):
+        """
+        Removes the index files of every version of `snapshot` but those in `keep`.
+        """
+        wanted = {cls.path(snapshot, version) for version in keep}
+        for path in glob.glob(glob.escape(snapshot) + ".*bm25.npz"):
+            # Including the single, unversioned file indexes used to be kept in
+            ours = re.fullmatch(r"(\.[0-9a-f]{16})?\.bm25\.npz", path[len(snapshot):])
+            if ours and path not in wanted: os.remove(path)
+
+    def save(self, path: str):
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, version=np.array(f"{INDEX_VERSION}:{self.version}"), zpids=self.zpids,
+                 vocabulary=np.array(self.vocabulary, dtype=str), offsets=self.offsets,
+                 rows=self.rows, counts=self.counts, lengths=self.lengths)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, version: str) -> Self | None:
+        """
+        The index saved at `path`, or None if there is none for dataset `version`.
+        """
+        if not os.path.exists(path): return None
+        with np.load(path) as saved:
+            if str(saved["version"]) != f"{INDEX_VERSION}:{version}": return None
+            return cls(version, saved["zpids"], saved["vocabulary"].tolist(), saved["offsets"],
+                       saved["rows"], saved["counts"], saved["lengths"])
+
+    @classmethod
+    def of(cls, dataset: Dataset | Listings) -> "TextIndex":
+        """
+        The index for `dataset`. A snapshot's index is kept in a file beside it,
+        one for each version of the snapshot.
+        """
+        with cls._lock:
+            hit = cls._built.get(id(dataset))
+        if hit is None or hit[0] is not dataset:
+            if isinstance(dataset, Dataset):
+                path = cls.path(dataset.snapshot.path, dataset.version)
+                index = cls.load(path, dataset.version)
+                if index is None:
+                    logging.info("Building text index for %s", dataset.snapshot.path)
+                    index = cls.build(dataset.version, dataset.root)
+                    index.save(path)
+            else:
+                index = cls.build("", dataset.root)
+            with cls._lock:
+                cls._built.pop(id(dataset), None)
+                hit = cls._built[id(dataset)] = (dataset, index)
+                while len(cls._built) > cls.KEEP:
+                    del cls._built[next(iter(cls._built))]
+        return hit[1]
+
+    def __len__(self) -> int:
+        return len(self.zpids)
+
+    def postings(self, text: str) -> Iterable[tuple[np.ndarray, np.ndarray]]:
+        for term in set(tokens(text)):
+            if (t := self.terms.get(term)) is not None:
+                start, end = self.offsets[t], self.offsets[t + 1]
+                yield self.rows[start:end], self.weights[start:end]
+
+    def score(self, text: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """
+        The BM25 score of every listing (or just those in `rows`) against `text`.
+        """
+        if rows is None:
+            scores = np.zeros(len(self), dtype=np.float32)
+            for (docs, weights) in self.postings(text):
+                scores[docs] += weights
+            return scores
+
+        scores = np.zeros(len(rows), dtype=np.float32)
+        for (docs, weights) in self.postings(text):
+            at = np.searchsorted(docs, rows)
+            found = at < len(docs)
+            found[found] = docs[at[found]] == rows[found]
+            scores[found] += weights[at[found]]
+        return scores
+
+    def top(self, text: str, n: int) -> np.ndarray:
+        """
+        The rows of the `n` listings best matching `text`, best first.
+        """
+        scores = self.score(text)
+        n = min(n, len(scores))
+        best = np.argpartition(-scores, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+        return best[np.argsort(-scores[best], kind='stable')]
+
+    def rows_of(self, zpids: np.ndarray) -> np.ndarray:
+        return self.by_zpid[np.searchsorted(self.zpids, zpids, sorter=self.by_zpid)]
+
+    def preorder(self, listings: Listings, text: str, cap: int | None = None) -> Listings:
+        """
+        `listings`, best match for `text` first, keeping only the first `cap` if given.
+        """
+        if not listings.root: return listings
+        rows = self.rows_of(np.fromiter((lst.zpid for lst in listings.root), dtype=np.int64))
+        order = np.argsort(-self.score(text, rows), kind='stable')[:cap]
+        return Listings.model_construct(root=[listings.root[i] for i in order])
+
+
+# Order candidates by how well they match the interview's soft preferences before ranking them
+PREORDER = bool(getenv("FINDBOT_PREORDER"))
+# If set, only this many candidates (best matches first) are ranked; implies FINDBOT_PREORDER
+CAP = int(getenv("FINDBOT_RANK_CAP") or 0) or None
+
+def candidates(dataset: Dataset | Listings, listings: Listings, convo: Conversation) -> Listings:
+    """
+    The listings to rank for an interview, as `PREORDER` and `CAP` configure.
+    """
+    if not (PREORDER or CAP): return listings
+    return TextIndex.of(dataset).preorder(listings, preferences(convo), CAP)
+
+if __name__ == "__main__":
+    from data import dataset
+    index = TextIndex.of(dataset)
+    print(f"Indexed {len(index)} listings, {len(index.terms)} terms")
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import TYPE_CHECKING
+
+import metrics
+from gazetteer import simplify
+from geocache import normalize
+
+if TYPE_CHECKING:
+    from oai import Conversation
+    from profiler import Preferences
+    from programmer import ApartmentQuery
+    from ranker import ListingScore, Ranker
+
+# Rents are rounded out to multiples of this before fingerprinting, so near-identical budgets match
+RENT_STEP = 250
+
+def digest(value) -> str:
+    return hashlib.blake2b(json.dumps(value, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def terms(items: list[str]) -> list[str]:
+    """
+    A profile's list of wants, however it was worded or ordered: case-folded,
+    without punctuation, deduplicated and sorted.
+    """
+    return sorted({normalize(re.sub(r"[^\w\s]", " ", item)) for item in items} - {""})
+
+def fingerprint(query: "ApartmentQuery", version: str, preferences: "Preferences | Conversation",
+                ranker: "type[Ranker]") -> str:
+    """
+    A key identifying the preferences behind `query`, against dataset
+    `version`, as scored by `ranker`'s prompt. `preferences` is the profile
+    distilled from the interview, of which only the lists of wants count (its
+    summary is prose, worded differently every time), or else the interview
+    itself, of which only what the user said counts.
+    """
+    minimum = query.minimum_rent // RENT_STEP * RENT_STEP
+    maximum = -(-query.maximum_rent // RENT_STEP) * RENT_STEP if query.maximum_rent else None
+    hoods = None if query.neighborhoods is None else sorted({simplify(h.name) for h in query.neighborhoods})
+
+    if isinstance(preferences, list):
+        wants = ("said", [normalize(str(msg["content"])) for msg in preferences if msg["role"] == "user"])
+    else:
+        wants = ("profile", terms(preferences.must_haves), terms(preferences.nice_to_haves),
+                 terms(preferences.dealbreakers))
+
+    canonical = repr((version, minimum, maximum, query.minimum_bedrooms, query.minimum_bathrooms, hoods,
+                      digest(wants), ranker.__qualname__, digest(ranker.INSTRUCTIONS)))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+class ScoreCache:
+    """
+    Listing scores shared between interviews with the same preference
+    fingerprint. They are kept in a SQLite file when given a `path`, so every
+    worker process shares them, with the entries this process has used
+    memoized in front of it. Past `size` entries, the least recently used are
+    evicted from memory and the oldest from the file, and anything older than
+    `ttl` seconds is evicted from both.
+    """
+
+    SIZE = 50_000
+    # A day: long enough to cover a busy period, short enough that prompt changes wash out
+    TTL = 24 * 60 * 60
+    # Puts between trimming the file back to `size` entries
+    TRIM = 1000
+
+    def __init__(self, enabled: bool, size: int = SIZE, ttl: float = TTL, path: str | None = None):
+        self.enabled = enabled
+        self.size = size
+        self.ttl = ttl
+        self.path = path
+        self.entries: OrderedDict[tuple[str, int], tuple[float, "ListingScore"]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.puts = 0
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork or a thread, so each opens its own
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.conn.execute("PRAGMA journal_mode=WAL")
+            local.conn.execute("""
+                CREATE TABLE IF NOT EXISTS scores (
+                    fingerprint TEXT NOT NULL,
+                    zpid INTEGER NOT NULL,
+                    score TEXT NOT NULL,
+                    stored REAL NOT NULL,
+                    PRIMARY KEY (fingerprint, zpid)
+                )""")
+            local.conn.execute("CREATE INDEX IF NOT EXISTS scores_stored ON scores (stored)")
+            local.pid = os.getpid()
+        return local.conn
+
+    def lookup(self, key: tuple[str, int]) -> tuple[float, "ListingScore"] | None:
+        if key in self.entries or self.path is None:
+            return self.entries.get(key)
+
+        from ranker import ListingScore
+
+        row = self.conn.execute("SELECT score, stored FROM scores WHERE fingerprint = ? AND zpid = ?", key).fetchone()
+        if row is None: return None
+        entry = self.entries[key] = (row[1], ListingScore.model_validate_json(row[0]))
+        self.trim()
+        return entry
+
+    def get(self, fingerprint: str, zpid: int) -> "ListingScore | None":
+        if not self.enabled: return None
+
+        key = (fingerprint, zpid)
+        entry = self.lookup(key)
+
+        if entry is None:
+            self.misses += 1
+            metrics.count("score_cache", result="miss")
+            return None
+        if time.time() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.stale += 1
+            self.misses += 1
+            metrics.count("score_cache", result="stale")
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        metrics.count("score_cache", result="hit")
+        return entry[1]
+
+    def put(self, fingerprint: str, zpid: int, score: "ListingScore"):
+        if not self.enabled: return
+
+        stored = time.time()
+        self.entries[(fingerprint, zpid)] = (stored, score)
+        self.entries.move_to_end((fingerprint, zpid))
+        self.trim()
+
+        if self.path is None: return
+        self.conn.execute("INSERT OR REPLACE INTO scores (fingerprint, zpid, score, stored) VALUES (?, ?, ?, ?)",
+                          (fingerprint, zpid, score.model_dump_json(), stored))
+        self.puts += 1
+        if self.puts % self.TRIM == 0:
+            self.evict()
+
+    def trim(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def evict(self) -> int:
+        """
+        Deletes every expired entry from the file, and the oldest past
+        `size`, returning how many there were.
+        """
+        return self.conn.execute("""
+            DELETE FROM scores WHERE stored <= ? OR rowid IN (
+                SELECT rowid FROM scores ORDER BY stored DESC LIMIT -1 OFFSET ?)""",
+            (time.time() - self.ttl, self.size)).rowcount
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"score cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), "
+                f"{self.stale} expired, {len(self.entries)} entries")
+
+scores = ScoreCache(enabled=bool(getenv("FINDBOT_SCORE_CACHE")),
+                    size=int(getenv("FINDBOT_SCORE_CACHE_SIZE") or ScoreCache.SIZE),
+                    ttl=float(getenv("FINDBOT_SCORE_CACHE_TTL") or ScoreCache.TTL),
+                    path=getenv("FINDBOT_SCORE_CACHE_PATH") or "./scores.sqlite")
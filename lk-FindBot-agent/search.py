@@ -0,0 +1,106 @@
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import metrics
+
+from data import Dataset, Listings
+from geocache import normalize
+from index import ListingIndex
+
+if TYPE_CHECKING:
+    from programmer import ApartmentQuery
+
+
+def hoods(query: "ApartmentQuery") -> set[str] | None:
+    return None if query.neighborhoods is None else {normalize(h.name) for h in query.neighborhoods}
+
+def narrows(new: "ApartmentQuery", old: "ApartmentQuery") -> bool:
+    """
+    Whether every listing matching `new` must also match `old`.
+    """
+    new_hoods, old_hoods = hoods(new), hoods(old)
+    return (new.minimum_rent >= old.minimum_rent
+            and (not old.maximum_rent or bool(new.maximum_rent) and new.maximum_rent <= old.maximum_rent)
+            and new.minimum_bedrooms >= old.minimum_bedrooms
+            and new.minimum_bathrooms >= old.minimum_bathrooms
+            and (old_hoods is None or new_hoods is not None and new_hoods <= old_hoods))
+
+def round_price(price: float) -> int:
+    return int(round(price / 500) * 500)
+
+
+class IncrementalSearch:
+    """
+    Runs a series of queries over one dataset. When a query only narrows the
+    one before it, just the previous matches are filtered, rather than
+    searching the whole dataset again.
+    """
+
+    def __init__(self, dataset: Dataset | Listings):
+        self.dataset = dataset
+        self.index = ListingIndex.of(dataset)
+        self.query: "ApartmentQuery | None" = None
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def search(self, query: "ApartmentQuery") -> np.ndarray:
+        incremental = self.query is not None and narrows(query, self.query)
+        with metrics.span("search", incremental=incremental):
+            rows = self.index.refine(self.rows, query) if incremental else self.index.select(query)
+
+        self.query, self.rows = query, rows
+        return rows
+
+    def listings(self) -> Listings:
+        # Built without validation, so matches can stay `ListingView`s
+        return Listings.model_construct(root=[self.dataset.root[i] for i in self.rows])
+
+    def histogram(self) -> list[str]:
+        """
+        How the current matches break down by price, size, and neighborhood.
+        """
+        rows, index = self.rows, self.index
+        if len(rows) == 0: return []
+
+        price = index.price[rows]
+        bedrooms, bathrooms = index.bedrooms[rows], index.bathrooms[rows]
+
+        counts = [f"{np.count_nonzero(price <= limit)} at or under ${limit}"
+                  for limit in sorted({round_price(p) for p in np.percentile(price, [25, 50, 75])})]
+        counts += [f"{np.count_nonzero(bedrooms >= n)} with at least {n} bedrooms"
+                   for n in range(1, 4) if np.any(bedrooms >= n)]
+        counts += [f"{np.count_nonzero(bathrooms >= n)} with at least {n} bathrooms"
+                   for n in range(2, 4) if np.any(bathrooms >= n)]
+
+        for hood in self.query.neighborhoods or []:
+            inside = index.within(rows, index.geometries(self.query.model_copy(update={"neighborhoods": [hood]})))
+            counts.append(f"{np.count_nonzero(inside)} in {hood.name}")
+
+        return counts
+
+    def relaxations(self) -> list[str]:
+        """
+        How many listings would match if each constraint of the current query were dropped.
+        """
+        query = self.query
+        loosened = []
+
+        if query.neighborhoods is not None:
+            loosened.append(("no neighborhood restriction", {"neighborhoods": None}))
+        if query.maximum_rent:
+            loosened.append(("no maximum rent", {"maximum_rent": None}))
+        if query.minimum_rent > 0:
+            loosened.append(("no minimum rent", {"minimum_rent": 0}))
+        if query.minimum_bedrooms > 0:
+            loosened.append((f"at least {query.minimum_bedrooms - 1} bedrooms", {"minimum_bedrooms": query.minimum_bedrooms - 1}))
+        if query.minimum_bathrooms > 0:
+            loosened.append((f"at least {query.minimum_bathrooms - 1} bathrooms", {"minimum_bathrooms": query.minimum_bathrooms - 1}))
+
+        return [f"{self.index.count(query.model_copy(update=update))} with {what}" for (what, update) in loosened]
+
+    def feedback(self) -> str:
+        parts = [f"{len(self.rows)} matches", *self.histogram()]
+        if relaxed := self.relaxations():
+            parts.append("if a single constraint were relaxed: " + ", ".join(relaxed))
+        return "; ".join(parts)
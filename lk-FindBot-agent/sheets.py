@@ -3,27 +3,179 @@ import logging
 
 logging.basicConfig(filename='logs', level=logging.DEBUG)
 
+import atexit
+import os
+import queue
+import random
+import threading
 from datetime import datetime
 from functools import singledispatchmethod
+from os import getenv
 from time import sleep
 
 import gspread
 
-from utils import panic
+import aio
+import fakesheets
+import metrics
 
 def stamp() -> str:
     return datetime.now().strftime("%c")
 
+class Writer:
+    """
+    A background thread which writes queued status and log events to the
+    spreadsheet, merging everything queued at once into as few API calls as
+    it can. Rate-limited calls are retried with exponential backoff and jitter.
+    """
+
+    # How long to wait for more events before writing a batch, in seconds
+    LINGER = 0.5
+    BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, summary):
+        self.summary = summary
+        self.events: queue.Queue = queue.Queue()
+        # Summary row of each interview, as far as this process knows
+        self.rows: dict[int, int] = {}
+        self.thread = threading.Thread(target=self.run, name="notes-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, *event):
+        self.events.put(event)
+
+    def join(self):
+        """
+        Blocks until everything queued so far has been written (or failed to
+        be), however much else is queued meanwhile.
+        """
+        written = threading.Event()
+        self.events.put(("flush", written))
+        written.wait()
+
+    def run(self):
+        while True:
+            batch = [self.events.get()]
+            sleep(self.LINGER)
+            while True:
+                try: batch.append(self.events.get_nowait())
+                except queue.Empty: break
+
+            try:
+                with metrics.span("notes_write"):
+                    self.write(batch)
+            except Exception:
+                logging.exception("Failed to write %d notes events", len(batch))
+            finally:
+                # Everything queued before a flush was in this batch or an earlier one
+                for (kind, *values) in batch:
+                    if kind == "flush": values[0].set()
+
+    def retrying(self, call, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return call(*args, **kwargs)
+            except gspread.exceptions.APIError as err:
+                delay = random.uniform(0, min(self.MAX_BACKOFF, self.BACKOFF * 2 ** attempt))
+                logging.warning("Sheets API error (%s), retrying in %.1fs", err, delay)
+                metrics.count("sheets_retries")
+                sleep(delay)
+                attempt += 1
+
+    def write(self, batch: list[tuple]):
+        startups: list[list] = []
+        statuses: dict[int, str] = {}
+        logs: dict[int, tuple] = {}
+        for (kind, *values) in batch:
+            if kind == "startup":
+                startups.append(values)
+            elif kind == "status":
+                (number, new) = values
+                statuses[number] = new
+            elif kind == "log":
+                (sheet, rows) = values
+                logs.setdefault(id(sheet), (sheet, []))[1].extend(rows)
+
+        if startups:
+            # Newest interview first, as `insert_row(index=2)` one at a time would leave them
+            startups.sort(key=lambda values: values[0], reverse=True)
+            self.retrying(self.summary.insert_rows, startups, row=2)
+            for number in self.rows: self.rows[number] += len(startups)
+            for (i, values) in enumerate(startups): self.rows[values[0]] = 2 + i
+
+        if statuses:
+            rows = self.locate(list(statuses))
+            updates = [{"range": f"C{rows[number]}", "values": [[new]]}
+                       for (number, new) in statuses.items() if number in rows]
+            if updates: self.retrying(self.summary.batch_update, updates)
+
+        for (sheet, rows) in logs.values():
+            rows.reverse()
+            try:
+                self.retrying(sheet.insert_rows, row=2, values=rows)
+            except Exception:
+                # Only this interview's log is lost, not everyone else's in the batch
+                logging.exception("Failed to write %d log rows to %s", len(rows), sheet.title)
+
+    def locate(self, numbers: list[int]) -> dict[int, int]:
+        """
+        The summary rows of the given interviews. Other processes insert rows
+        too, so cached rows are checked with a single read, and only the
+        interviews that have moved are searched for. Interviews with no
+        summary row are logged and left out, rather than failing the batch.
+        """
+        known = [n for n in numbers if n in self.rows]
+        if known:
+            cells = self.retrying(self.summary.batch_get, [f"A{self.rows[n]}" for n in known])
+            for (number, cell) in zip(known, cells):
+                if not cell or not cell[0] or cell[0][0] != str(number):
+                    del self.rows[number]
+
+        for number in numbers:
+            if number not in self.rows:
+                entry = self.retrying(self.summary.find, str(number), in_column=1)
+                if entry is None:
+                    logging.error("Invalid interview #%d: no summary row, dropping its status", number)
+                    continue
+                self.rows[number] = entry.row
+
+        return self.rows
+
 class Notes:
-    gc = gspread.service_account(filename="./sheets-account.json")
+    gc = (fakesheets if getenv("FINDBOT_FAKE_SHEETS") else gspread).service_account(filename="./sheets-account.json")
     sheet = gc.open("FindBot Spreadsheet")
     summary = sheet.sheet1
 
+    # The writer thread for this process, and the process it was started in
+    _writer: Writer | None = None
+    _writer_pid: int | None = None
+    # The last interview number handed out by this process, and the lock new notes take it under
+    _last_number = -1
+    _numbering = threading.Lock()
+
+    @classmethod
+    def writer(cls) -> Writer:
+        # Threads don't survive a fork, so each process starts its own writer
+        if cls._writer is None or cls._writer_pid != os.getpid():
+            cls._writer = Writer(cls.summary)
+            cls._writer_pid = os.getpid()
+            metrics.gauge("notes_queue_depth", cls._writer.events.qsize)
+        return cls._writer
+
+    @classmethod
+    def drain(cls):
+        # Only this process's own writer can be waited on
+        if cls._writer is not None and cls._writer_pid == os.getpid():
+            cls._writer.join()
+
     @classmethod
     def count(cls):
         inums = cls.summary.get("A2:A", major_dimension="COLUMNS")[0]
-        if not inums: return 0
-        return max(map(int, inums)) + 1
+        remote = max(map(int, inums)) + 1 if inums else 0
+        # Our own new interviews may still be waiting in the writer's queue
+        return max(remote, cls._last_number + 1)
 
     @classmethod
     def from_id(cls, id: int) -> "Notes":
@@ -31,37 +183,48 @@ class Notes:
 
         blank_note.number = id
         blank_note.log_sheet = cls.sheet.worksheet(f"Interview #{id}")
-        blank_note.backlog = []
+        blank_note.last_status = None
 
         return blank_note
 
+    @classmethod
+    async def acreate(cls) -> "Notes":
+        """
+        Starts the notes for a new interview without blocking the event loop.
+        """
+        return await aio.run("sheets", cls)
+
+    @classmethod
+    async def afrom_id(cls, id: int) -> "Notes":
+        return await aio.run("sheets", cls.from_id, id)
+
     def __init__(self):
-        self.number = self.count()
+        # Notes are started from several threads at once, which mustn't take the same number
+        with Notes._numbering:
+            self.number = self.count()
+            Notes._last_number = self.number
         self.log_sheet = self.sheet.add_worksheet(f"Interview #{self.number}", 0, 10)
-        self.backlog = []
+        self.last_status = "STARTUP"
 
         self.log_sheet.insert_row(["Timestamp", "Event"])
-        self.summary.insert_row(index=2, values=[self.number, stamp(), "STARTUP"])
+        self.writer().put("startup", self.number, stamp(), "STARTUP")
 
     def status(self, new):
-        entry = self.summary.find(str(self.number), in_column=1) or panic("Invalid interview!")
+        if self.last_status == new: return
+        self.last_status = new
 
-        if entry.value == new: return
-
-        self.summary.update_cell(entry.row, 3, new)
+        self.writer().put("status", self.number, new)
         self.log(new)
 
-        self.flush()
-
     def flush(self):
-        self.backlog.reverse()
-        while True:
-            try:
-                self.log_sheet.insert_rows(row=2, values=self.backlog)
-                self.backlog.clear()
-                return
-            except gspread.exceptions.APIError:
-                sleep(3)
+        """
+        Blocks until everything logged so far has been written.
+        """
+        with metrics.span("notes_flush"):
+            self.writer().join()
+
+    async def aflush(self):
+        await aio.run("sheets", self.flush)
 
     @singledispatchmethod
     def log(self, st):
@@ -75,10 +238,9 @@ class Notes:
     @log.register
     def _(self, lst: list):
         stmp = stamp()
-        self.backlog.extend([[stmp, str(l)] for l in lst])
+        self.writer().put("log", self.log_sheet, [[stmp, str(l)] for l in lst])
         logging.info(stmp)
         for l in lst:
             logging.info(l)
 
-        if len(self.backlog) > 20:
-            self.flush()
+atexit.register(Notes.drain)
@@ -0,0 +1,112 @@
+
+import json
+import mmap
+import os
+import struct
+from typing import Iterable
+
+import numpy as np
+
+MAGIC = b"FBSNAP01"
+# Every section starts on a multiple of this, so columns can be viewed in place
+ALIGN = 8
+
+def aligned(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+def write(path: str, checksum: str, columns: dict[str, np.ndarray], records: Iterable[bytes],
+          lengths: np.ndarray | None = None, **meta):
+    """
+    Writes a snapshot: a JSON header describing the layout (plus anything in
+    `meta`), followed by each column as a raw array and then every record's
+    bytes back to back. The file is written beside `path` and moved into
+    place, so readers never see a partial snapshot, and readers which already
+    have the old one open keep reading it undisturbed.
+
+    Each of `records` is one record, unless `lengths` gives the length of
+    every record, in which case they may be chunks of any size (say, runs of
+    records copied whole from another snapshot).
+    """
+    if lengths is None:
+        records = list(records)
+        lengths = np.fromiter(map(len, records), dtype=np.int64, count=len(records))
+    offsets = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(lengths, dtype=np.int64)))
+    sections = [*columns.items(), ("record_offsets", offsets)]
+
+    layout, position = {}, 0
+    for (name, column) in sections:
+        layout[name] = {"dtype": column.dtype.str, "count": len(column), "offset": position}
+        position = aligned(position + column.nbytes)
+
+    header = json.dumps({
+        "checksum": checksum,
+        "count": len(lengths),
+        "columns": layout,
+        "records": position,
+        **meta,
+    }).encode()
+
+    start = aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as file:
+        file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for (name, column) in sections:
+            file.seek(start + layout[name]["offset"])
+            file.write(np.ascontiguousarray(column).tobytes())
+        file.seek(start + position)
+        for chunk in records:
+            file.write(chunk)
+    os.replace(tmp, path)
+
+class Snapshot:
+    """
+    A read-only, memory-mapped snapshot. Columns are NumPy views straight onto
+    the mapped file, and records are only read when asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a dataset snapshot")
+
+        (length,) = struct.unpack_from("<Q", self.buffer, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(self.buffer[header_start:header_start + length])
+        self.start = aligned(header_start + length)
+
+        self.columns = {
+            name: np.frombuffer(self.buffer, dtype=np.dtype(spec["dtype"]), count=spec["count"],
+                                offset=self.start + spec["offset"])
+            for (name, spec) in self.header["columns"].items()
+        }
+        self.offsets = self.columns.pop("record_offsets")
+        self.records = self.start + self.header["records"]
+
+    @property
+    def checksum(self) -> str:
+        return self.header["checksum"]
+
+    @property
+    def source(self) -> str:
+        """
+        The checksum of the JSON dataset this snapshot was compiled from, before any deltas were applied.
+        """
+        return self.header.get("source", self.checksum)
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def record(self, row: int) -> bytes:
+        lo, hi = self.offsets[row], self.offsets[row + 1]
+        return self.buffer[self.records + lo:self.records + hi]
+
+    def span(self, first: int, last: int) -> bytes:
+        """
+        The records of rows `first` up to (but not including) `last`, back to back.
+        """
+        return self.buffer[self.records + self.offsets[first]:self.records + self.offsets[last]]
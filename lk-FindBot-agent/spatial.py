@@ -0,0 +1,67 @@
+
+import math
+
+import numpy as np
+
+from maps import EPSILON, includes_all
+
+
+class GridIndex:
+    """
+    Buckets listing coordinates into a uniform latitude/longitude grid, so
+    that the listings inside a box (or near a point) can be found by visiting
+    only the cells that box overlaps.
+    """
+
+    # Side of a grid cell in degrees, roughly 500m in Manhattan
+    CELL = 0.005
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, cell: float = CELL):
+        self.cell = cell
+        self.latitude = latitude
+        self.longitude = longitude
+
+        ys = np.floor(latitude / cell).astype(np.int64)
+        xs = np.floor(longitude / cell).astype(np.int64)
+
+        # Rows grouped by cell; each cell owns a contiguous run of `self.rows`
+        self.rows = np.lexsort((xs, ys))
+        ys, xs = ys[self.rows], xs[self.rows]
+        starts = np.flatnonzero(np.r_[True, (ys[1:] != ys[:-1]) | (xs[1:] != xs[:-1])])
+        ends = np.r_[starts[1:], len(self.rows)]
+
+        self.cells: dict[tuple[int, int], tuple[int, int]] = {
+            (int(ys[s]), int(xs[s])): (int(s), int(e)) for (s, e) in zip(starts, ends)
+        }
+
+    def candidates(self, lat_lo: float, lat_hi: float, lng_lo: float, lng_hi: float) -> np.ndarray:
+        """
+        Rows in every cell overlapping the box; a superset of the rows inside it.
+        """
+        y_lo, y_hi = math.floor(lat_lo / self.cell), math.floor(lat_hi / self.cell)
+        x_lo, x_hi = math.floor(lng_lo / self.cell), math.floor(lng_hi / self.cell)
+
+        if (y_hi - y_lo + 1) * (x_hi - x_lo + 1) <= len(self.cells):
+            keys = ((y, x) for y in range(y_lo, y_hi + 1) for x in range(x_lo, x_hi + 1))
+        else:
+            keys = (k for k in self.cells if y_lo <= k[0] <= y_hi and x_lo <= k[1] <= x_hi)
+
+        runs = [self.rows[slice(*self.cells[k])] for k in keys if k in self.cells]
+        return np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+
+    def region(self, geometry) -> np.ndarray:
+        """
+        The (sorted) rows `maps.includes` would accept for a geocoded `geometry`.
+        """
+        if geometry['location_type'] == 'APPROXIMATE':
+            ne, sw = geometry['bounds']['northeast'], geometry['bounds']['southwest']
+            lat_lo, lat_hi = sorted((ne['lat'], sw['lat']))
+            lng_lo, lng_hi = sorted((ne['lng'], sw['lng']))
+        else:
+            loc = geometry['location']
+            lat_lo, lat_hi = loc['lat'] - EPSILON, loc['lat'] + EPSILON
+            lng_lo, lng_hi = loc['lng'] - EPSILON, loc['lng'] + EPSILON
+
+        rows = self.candidates(lat_lo, lat_hi, lng_lo, lng_hi)
+        rows = rows[includes_all(geometry, self.latitude[rows], self.longitude[rows])]
+        return np.sort(rows)
@@ -0,0 +1,141 @@
+
+import asyncio
+import hashlib
+import json
+import logging
+from contextlib import aclosing
+from typing import Callable
+
+from pydantic import BaseModel
+
+import aio
+import metrics
+from data import Dataset, Listings
+from interview import Interview
+from maps import warm
+from oai import Conversation
+from programmer import ApartmentQuery, Programmer
+from ranker import ListingScore, Ranker
+from relax import fit
+from retrieval import candidates
+from scorecache import fingerprint
+from search import IncrementalSearch
+from sheets import Notes
+
+
+def digest(convo: Conversation) -> str:
+    """
+    Identifies what the user said in a transcript, so a draft can tell whether
+    they said anything after it. The interviewer answering them changes nothing.
+    """
+    said = [msg['content'] for msg in convo if msg['role'] == 'user']
+    return hashlib.blake2b(json.dumps(said, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+async def key(it: Interview, query: ApartmentQuery, version: str, ranker: type[Ranker]) -> str:
+    """
+    The fingerprint drafted scores are kept under: the query, and the profile
+    distilled from the transcript (or, failing that, what the user said). So
+    they still hold once the user has said more, as long as it changed neither.
+    """
+    await ranker.shared_prefix(it, condense=True)
+    return fingerprint(query, version, it.profile if it.profile is not None else it.convo, ranker)
+
+class Draft(BaseModel):
+    """
+    The recommendation pipeline's work, done ahead of time on a partial transcript.
+    """
+    # What the user had said when the query was drafted
+    transcript: str
+    query: ApartmentQuery
+    # The query and profile the listings were scored under
+    fingerprint: str
+    scores: dict[int, ListingScore] = {}
+
+    async def holds(self, it: Interview, query: ApartmentQuery, version: str, ranker: type[Ranker]) -> bool:
+        """
+        Whether the draft's scores hold for the finished interview `it`, searched with `query`.
+        """
+        return self.fingerprint == await key(it, query, version, ranker)
+
+class Speculator:
+    """
+    Drafts a query, geocodes its neighborhoods and pre-scores some of its
+    matches in the background while the interview is still going, redrafting
+    whenever the user has said more. The last draft goes along with the
+    finished interview, to be reused wherever it still agrees with the final
+    transcript.
+    """
+
+    # Seconds between drafts
+    INTERVAL = 30.0
+    # User turns before the first draft, as there is little to go on before then
+    MIN_TURNS = 3
+    # Listings pre-scored under any one set of preferences
+    PRESCORE = 25
+
+    def __init__(self, dataset: Dataset, ranker: type[Ranker] = Ranker, min: int = 5, max: int = 100):
+        self.dataset = dataset
+        self.ranker = ranker
+        self.min, self.max = min, max
+        self.draft: Draft | None = None
+        self.task: asyncio.Task | None = None
+
+    def start(self, notes: Notes, transcript: Callable[[], Conversation]):
+        self.task = asyncio.create_task(self.run(notes, transcript))
+
+    def stop(self):
+        """
+        Abandons any draft in progress, leaving `draft` as the latest one.
+        """
+        if self.task is not None: self.task.cancel()
+
+    async def run(self, notes: Notes, transcript: Callable[[], Conversation]):
+        turns = 0
+        while True:
+            await asyncio.sleep(self.INTERVAL)
+
+            convo = transcript()
+            said = sum(1 for msg in convo if msg['role'] == 'user')
+            if said < self.MIN_TURNS or said == turns: continue
+            turns = said
+
+            try:
+                with metrics.span("speculate"):
+                    await self.speculate(Interview(convo, notes))
+            except Exception:
+                logging.exception("Failed to draft recommendations")
+
+    def match(self, query: ApartmentQuery) -> tuple[ApartmentQuery, IncrementalSearch]:
+        """
+        Searches for `query`, relaxing or tightening it into the range of matches wanted.
+        """
+        search = IncrementalSearch(self.dataset)
+        if not self.min <= len(search.search(query)) <= self.max:
+            query = fit(search, self.min, self.max)
+            search.search(query)
+        return (query, search)
+
+    async def speculate(self, it: Interview):
+        query = await Programmer(it).write_query()
+        await warm(hood.name for hood in query.neighborhoods or [])
+
+        # The interview is still going on this event loop, so the searching is done off it
+        (query, search) = await aio.run("search", self.match, query)
+
+        prefix = await self.ranker.shared_prefix(it)
+        drafted = await key(it, query, self.dataset.version, self.ranker)
+        # Listings already scored under the same query and profile needn't be scored again
+        scores = self.draft.scores if self.draft is not None and self.draft.fingerprint == drafted else {}
+        self.draft = Draft(transcript=digest(it.convo), query=query, fingerprint=drafted, scores=scores)
+        it.notes.log(f"Drafted query {query.model_dump_json()}, {len(search.rows)} matches")
+
+        likely = await aio.run("search", candidates, self.dataset, search.listings(), it.convo)
+        unscored = [lst for lst in likely.root if lst.zpid not in self.draft.scores]
+        unscored = unscored[:max(0, self.PRESCORE - len(self.draft.scores))]
+        if not unscored: return
+
+        async with aclosing(self.ranker.stream(it, Listings.model_construct(root=unscored), prefix=prefix)) as ranked:
+            async for (lst, score) in ranked:
+                if score: self.draft.scores[lst.zpid] = score
+
+        it.notes.log(f"Pre-scored {len(self.draft.scores)} listings ({it.usage.describe()})")
@@ -0,0 +1,31 @@
+"""
+The modules under test read their configuration from the environment when
+they are imported, so it is set up here first: a small synthetic dataset in a
+scratch directory, the local fake of Google Sheets, the offline gazetteer in
+place of Google Maps, and an API key which is never used.
+"""
+
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench import synthesize
+
+WORKDIR = tempfile.mkdtemp(prefix="findbot-tests-")
+DATASET = os.path.join(WORKDIR, "listings.json")
+synthesize(300, DATASET)
+
+os.environ.update({
+    "DATASET_PATH": DATASET,
+    "SNAPSHOT_PATH": DATASET + ".snapshot",
+    "GEOCODE_CACHE_PATH": os.path.join(WORKDIR, "geocodes.sqlite"),
+    "FINDBOT_SCORE_CACHE_PATH": os.path.join(WORKDIR, "scores.sqlite"),
+    "JOB_QUEUE_PATH": os.path.join(WORKDIR, "jobs.sqlite"),
+    "FINDBOT_FAKE_SHEETS": "1",
+    "FINDBOT_FAKE_SHEETS_PATH": os.path.join(WORKDIR, "fakesheets.json"),
+    "FINDBOT_OFFLINE": "1",
+    "OPENAI_API_KEY": "test",
+})
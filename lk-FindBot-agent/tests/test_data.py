@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import data
+from conftest import DATASET
+from data import Dataset, compile_snapshot, parse
+from snapshot import Snapshot
+
+def zpids(source: str, **kwargs) -> list[int]:
+    return [lst.zpid for lst in parse(source, **kwargs)]
+
+def test_parse_streams_arrays_and_lines(tmp_path):
+    with open(DATASET) as file:
+        listings = json.load(file)
+    expected = [lst["zpid"] for lst in listings]
+
+    lines = tmp_path / "listings.ndjson"
+    lines.write_text("\n".join(json.dumps(lst) for lst in listings))
+
+    assert zpids(DATASET) == expected
+    # Listings split across reads are put back together
+    assert zpids(DATASET, chunk=100) == expected
+    assert zpids(str(lines), chunk=100) == expected
+
+def test_parse_empty_and_broken(tmp_path):
+    empty = tmp_path / "empty.json"
+    empty.write_text(" [ ] ")
+    assert zpids(str(empty)) == []
+
+    broken = tmp_path / "broken.json"
+    with open(DATASET) as file:
+        broken.write_text(file.read()[:5000])
+    with pytest.raises(ValueError):
+        zpids(str(broken), chunk=1000)
+
+def test_compiled_snapshot_matches_the_dataset(tmp_path):
+    target = str(tmp_path / "listings.snapshot")
+    compile_snapshot(DATASET, target, "test")
+    compiled = Dataset(Snapshot(target))
+
+    assert compiled.version == "test"
+    assert compiled.column("zpid").tolist() == data.dataset.column("zpid").tolist()
+    assert compiled.column("tokens").tolist() == data.dataset.column("tokens").tolist()
+    assert compiled.root[7].model() == next(lst for (i, lst) in enumerate(parse(DATASET)) if i == 7)
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import data
+from conftest import DATASET
+from data import Dataset, Listing
+from ingest import Delta, apply
+from retrieval import TextIndex
+from snapshot import Snapshot
+
+@pytest.fixture
+def dataset(tmp_path) -> Dataset:
+    """
+    A copy of the test dataset's snapshot, with its text index, to apply deltas to.
+    """
+    path = str(tmp_path / "listings.snapshot")
+    shutil.copy(data.dataset.snapshot.path, path)
+    copy = Dataset(Snapshot(path))
+    TextIndex.of(copy)
+    return copy
+
+def listing(row: int, **changes) -> Listing:
+    with open(DATASET) as file:
+        return Listing.model_validate({**json.load(file)[row], **changes})
+
+def test_apply_updates_adds_and_deletes(dataset):
+    zpids = dataset.column("zpid")
+    changed = listing(3, price=1234, description="Newly renovated, with a rooftop sauna.")
+    added = listing(4, zpid=10**9)
+    delta = Delta(upsert=[changed, added], delete=[int(zpids[0]), int(zpids[5])])
+
+    updated = apply(dataset, delta)
+
+    assert len(updated) == len(dataset) - 1
+    assert updated.column("zpid").tolist() == [*zpids[1:5].tolist(), *zpids[6:].tolist(), 10**9]
+    assert updated.root[2].price == 1234
+    assert updated.root[2].description == changed.description
+    assert updated.root[-1].model() == added
+    # Untouched listings are carried over exactly
+    assert updated.snapshot.record(0) == dataset.snapshot.record(1)
+    assert updated.snapshot.record(len(updated) - 2) == dataset.snapshot.record(len(dataset) - 1)
+    assert updated.snapshot.header["parent"] == dataset.version
+
+def test_apply_twice_with_the_same_delta_is_deterministic(dataset, tmp_path):
+    delta = Delta(upsert=[listing(7, price=999)])
+
+    first = apply(dataset, delta, str(tmp_path / "first.snapshot"))
+    second = apply(dataset, delta, str(tmp_path / "second.snapshot"))
+
+    assert first.version == second.version != dataset.version
+
+def test_apply_updates_the_text_index(dataset):
+    zpids = dataset.column("zpid")
+    delta = Delta(upsert=[listing(3, description="A rooftop sauna and a doorman."), listing(4, zpid=10**9)],
+                  delete=[int(zpids[0])])
+
+    updated = apply(dataset, delta)
+    path = TextIndex.path(updated.snapshot.path, updated.version)
+    assert os.path.exists(path)
+    patched, rebuilt = TextIndex.load(path, updated.version), TextIndex.build(updated.version, updated.root)
+
+    assert np.array_equal(patched.zpids, rebuilt.zpids)
+    for text in ["rooftop sauna", "doorman", "quiet sunny pet friendly laundry"]:
+        assert np.allclose(patched.score(text), rebuilt.score(text), rtol=1e-5, atol=1e-6)
+
+def test_apply_keeps_only_the_latest_text_indexes(dataset):
+    first = apply(dataset, Delta(upsert=[listing(1, price=1500)]))
+    second = apply(first, Delta(upsert=[listing(2, price=1600)]))
+
+    directory = os.path.dirname(dataset.snapshot.path)
+    kept = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".bm25.npz"))
+    assert kept == sorted(TextIndex.path(dataset.snapshot.path, d.version) for d in (first, second))
+
+def test_concurrent_ingests_both_apply(dataset):
+    deltas = [Delta(upsert=[listing(1, price=1111)]), Delta(upsert=[listing(2, price=2222)])]
+
+    # Both start from the same version, as two ingest processes would
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda delta: apply(dataset, delta), deltas))
+
+    latest = Dataset(Snapshot(dataset.snapshot.path))
+    assert (latest.root[1].price, latest.root[2].price) == (1111, 2222)
+    assert latest.snapshot.header["parent"] != dataset.version
@@ -0,0 +1,48 @@
+import asyncio
+
+import data
+from data import Listings
+from interview import Interview
+from leaderboard import stream_top
+from ranker import ListingScore, Ranker
+from sheets import Notes
+
+class Scripted(Ranker):
+    """
+    Scores listings by their zpids instead of asking an LLM, leaving every
+    fifth unscored and spending `COST` prompt tokens on each.
+    """
+    COST = 100
+
+    @classmethod
+    async def shared_prefix(cls, it, condense=None):
+        return it.convo
+
+    @classmethod
+    async def stream(cls, it, listings, concurrency=Ranker.CONCURRENCY, timeout=None, prefix=None):
+        for lst in listings.root:
+            it.usage.record(cls.COST)
+            yield (lst, ListingScore(benefits=[], drawbacks=[], final_score=lst.zpid % 97) if lst.zpid % 5 else None)
+
+def interview() -> Interview:
+    return Interview([{"role": "user", "content": "Somewhere quiet."}], Notes())
+
+def listings(count: int) -> Listings:
+    return Listings.model_construct(root=list(data.dataset.root[:count]))
+
+def test_stream_top_keeps_the_best_scores():
+    some = listings(40)
+    best = asyncio.run(stream_top(interview(), some, k=5, ranker=Scripted))
+
+    expected = sorted((lst for lst in some.root if lst.zpid % 5), key=lambda lst: (lst.zpid % 97, lst.zpid), reverse=True)
+    assert [lst.zpid for (lst, _) in best] == [lst.zpid for lst in expected[:5]]
+    assert [score.final_score for (_, score) in best] == [lst.zpid % 97 for lst in expected[:5]]
+
+def test_stream_top_stops_at_the_token_budget():
+    it = interview()
+    asyncio.run(stream_top(it, listings(40), k=5, token_budget=250, ranker=Scripted))
+
+    assert it.usage.requests == 3
+
+def test_stream_top_with_nothing_to_rank():
+    assert asyncio.run(stream_top(interview(), listings(0), ranker=Scripted)) == []
@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import data
+import oai
+from bench import FakeOpenAI, text
+from data import Listings
+from interview import Interview
+from listwise import BatchRanker
+from ranker import Ranker
+from sheets import Notes
+from tokens import IMAGE_TOKENS
+
+def response(status: int, headers: dict | None = None):
+    return SimpleNamespace(request=None, status_code=status, headers=headers or {})
+
+def rate_limited() -> openai.RateLimitError:
+    return openai.RateLimitError("Rate limit reached", response=response(429, {"retry-after": "0"}), body=None)
+
+def bad_image() -> openai.BadRequestError:
+    return openai.BadRequestError("Invalid image URL", response=response(400), body={"code": "invalid_image_url"})
+
+class FlakyOpenAI(FakeOpenAI):
+    """
+    The benchmark's stand-in for OpenAI, failing each listing's first
+    requests as scripted in `failures` (an exception to raise, or "hang" to
+    answer too slowly), and keeping count of requests and how many were in
+    flight at once.
+    """
+
+    def __init__(self, listings: list, failures: dict[int, list] | None = None, latency: float = 0.0):
+        super().__init__(latency)
+        self.zpids = {lst.summarize(): lst.zpid for lst in listings}
+        self.failures = failures or {}
+        self.requests: dict[int, int] = {}
+        self.inflight = self.peak = 0
+
+    async def answer(self, messages, spec):
+        zpid = self.zpids.get(text(messages[-1]))
+        self.requests[zpid] = self.requests.get(zpid, 0) + 1
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        try:
+            if self.failures.get(zpid):
+                failure = self.failures[zpid].pop(0)
+                if failure == "hang":
+                    await asyncio.sleep(10)
+                raise failure
+            return await super().answer(messages, spec)
+        finally:
+            self.inflight -= 1
+
+@pytest.fixture
+def listings() -> list:
+    return list(data.dataset.root[:12])
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(Ranker, "BACKOFF", 0.0)
+
+def fake(monkeypatch, llm: FakeOpenAI):
+    monkeypatch.setattr(oai, "client", oai.measure(llm))
+
+def interview() -> Interview:
+    return Interview([{"role": "user", "content": "Somewhere quiet with lots of light."}], Notes())
+
+def test_rank_all_retries_rate_limits_and_timeouts_and_skips_bad_images(monkeypatch, listings):
+    (limited, slow, broken) = (lst.zpid for lst in listings[:3])
+    llm = FlakyOpenAI(listings, {limited: [rate_limited(), rate_limited()], slow: ["hang"], broken: [bad_image()]})
+    fake(monkeypatch, llm)
+    it = interview()
+
+    ranked = asyncio.run(Ranker.rank_all(it, Listings.model_construct(root=listings), timeout=0.5))
+
+    assert sorted(lst.zpid for (lst, _) in ranked) == sorted(lst.zpid for lst in listings if lst.zpid != broken)
+    assert (llm.requests[limited], llm.requests[slow], llm.requests[broken]) == (3, 2, 1)
+    # Only the successful responses are counted
+    assert it.usage.requests == len(listings) - 1
+
+def test_rank_all_caps_requests_in_flight(monkeypatch, listings):
+    llm = FlakyOpenAI(listings, latency=0.02)
+    fake(monkeypatch, llm)
+
+    ranked = asyncio.run(Ranker.rank_all(interview(), Listings.model_construct(root=listings), concurrency=3))
+
+    assert len(ranked) == len(listings)
+    assert llm.peak == 3
+
+def test_retrying_gives_up_after_its_retries():
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        raise rate_limited()
+
+    result = asyncio.run(Ranker.retrying(interview(), "a listing", request, asyncio.Semaphore(1), retries=3))
+
+    assert result is None
+    assert calls == 3
+
+def test_batches_are_bounded_by_count_and_tokens(monkeypatch, listings):
+    monkeypatch.setattr(BatchRanker, "BATCH", 5)
+    assert [len(batch) for batch in BatchRanker.batches(listings)] == [5, 5, 2]
+
+    cost = lambda lst: lst.summary_tokens() + len(lst.photo_urls(BatchRanker.PHOTOS)) * IMAGE_TOKENS
+    monkeypatch.setattr(BatchRanker, "BATCH_TOKENS", 2 * max(map(cost, listings)))
+    batches = BatchRanker.batches(listings)
+
+    assert [lst for batch in batches for lst in batch] == listings
+    assert all(sum(map(cost, batch)) <= BatchRanker.BATCH_TOKENS for batch in batches)
+    assert max(map(len, batches)) < 5
@@ -0,0 +1,41 @@
+import data
+from programmer import ApartmentQuery
+from relax import fit
+from search import IncrementalSearch
+
+def matches(query: ApartmentQuery) -> int:
+    return len(IncrementalSearch(data.dataset).search(query))
+
+def test_fit_loosens_a_query_with_too_few_matches():
+    search = IncrementalSearch(data.dataset)
+    query = ApartmentQuery(minimum_rent=0, maximum_rent=1500, minimum_bathrooms=2, minimum_bedrooms=3,
+                           neighborhoods=[{"name": "Chelsea"}])
+    assert len(search.search(query)) < 5
+
+    fitted = fit(search, 5, 20)
+
+    assert 5 <= matches(fitted) <= 20
+    assert fitted.maximum_rent is None or fitted.maximum_rent >= 1500
+
+def test_fit_tightens_a_query_with_too_many_matches():
+    search = IncrementalSearch(data.dataset)
+    assert len(search.search(ApartmentQuery.ANY())) > 20
+
+    assert 5 <= matches(fit(search, 5, 20)) <= 20
+
+def test_fit_leaves_a_query_in_range_alone():
+    query = ApartmentQuery(minimum_rent=3000, maximum_rent=6000, minimum_bathrooms=1, minimum_bedrooms=1,
+                           neighborhoods=None)
+    search = IncrementalSearch(data.dataset)
+    count = len(search.search(query))
+
+    assert fit(search, count, count) == query
+
+def test_fit_returns_the_closest_attempt_when_out_of_rounds():
+    search = IncrementalSearch(data.dataset)
+    search.search(ApartmentQuery.ANY())
+
+    # No query matches a negative number of listings
+    fitted = fit(search, 0, -1, rounds=2)
+
+    assert matches(fitted) < len(data.dataset)
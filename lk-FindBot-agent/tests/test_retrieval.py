@@ -0,0 +1,46 @@
+import numpy as np
+
+import data
+from data import Listings
+from retrieval import TextIndex, document, tokens
+
+def test_tokens_drop_stopwords_and_plurals():
+    assert tokens("The dogs and cats are allowed, but no glass!") == ["dog", "cat", "allowed", "glass"]
+
+def test_rare_terms_find_their_listing():
+    index = TextIndex.build("test", data.dataset.root)
+    once = int(np.flatnonzero(np.diff(index.offsets) == 1)[0])
+    term = index.vocabulary[once]
+    row = int(index.rows[index.offsets[once]])
+
+    assert term in tokens(document(data.dataset.root[row]))
+    assert index.top(term, 1).tolist() == [row]
+    assert np.count_nonzero(index.score(term)) == 1
+
+def test_scores_of_some_rows_agree_with_all():
+    index = TextIndex.build("test", data.dataset.root)
+    rows = np.arange(0, len(index), 3)
+    text = "quiet sunny dishwasher laundry pet friendly"
+
+    assert np.allclose(index.score(text, rows), index.score(text)[rows])
+
+def test_preorder_puts_best_matches_first():
+    listings = Listings.model_construct(root=list(data.dataset.root[:50]))
+    index = TextIndex.of(data.dataset)
+    text = "doorman gym rooftop"
+
+    ordered = index.preorder(listings, text, cap=10)
+    scores = index.score(text, index.rows_of(np.array([lst.zpid for lst in ordered.root])))
+
+    assert len(ordered.root) == 10
+    assert np.all(np.diff(scores) <= 0)
+    assert scores[0] == index.score(text, index.rows_of(np.array([lst.zpid for lst in listings.root]))).max()
+
+def test_saved_index_belongs_to_its_version(tmp_path):
+    index = TextIndex.build("v1", data.dataset.root)
+    index.save(path := str(tmp_path / "index.npz"))
+
+    loaded = TextIndex.load(path, "v1")
+    assert np.array_equal(loaded.score("pet"), index.score("pet"))
+    assert TextIndex.load(path, "v2") is None
+    assert TextIndex.path("x.snapshot", "v1") != TextIndex.path("x.snapshot", "v2")
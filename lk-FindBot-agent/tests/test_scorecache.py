@@ -0,0 +1,78 @@
+import asyncio
+
+import oai
+from bench import FakeOpenAI
+from interview import Interview
+from listwise import BatchRanker
+from programmer import ApartmentQuery
+from ranker import ListingScore, Ranker
+from scorecache import ScoreCache, fingerprint
+from sheets import Notes
+
+QUERY = ApartmentQuery(minimum_rent=2000, maximum_rent=3500, minimum_bathrooms=1, minimum_bedrooms=1,
+                       neighborhoods=[{"name": "Chelsea"}])
+
+def conversation(wants: str):
+    return [{"role": "assistant", "content": "What are you looking for?"},
+            {"role": "user", "content": f"A one bedroom in Chelsea under $3,500. {wants}"}]
+
+def test_different_soft_preferences_do_not_share_scores():
+    quiet = conversation("I work nights, so it has to be quiet.")
+    social = conversation("I love having people over, so I want a big living room.")
+
+    cache = ScoreCache(enabled=True)
+    cache.put(fingerprint(QUERY, "v1", quiet, Ranker), 42,
+              ListingScore(benefits=["Quiet street"], drawbacks=[], final_score=90))
+
+    assert fingerprint(QUERY, "v1", quiet, Ranker) != fingerprint(QUERY, "v1", social, Ranker)
+    assert cache.get(fingerprint(QUERY, "v1", social, Ranker), 42) is None
+    assert cache.get(fingerprint(QUERY, "v1", quiet, Ranker), 42).final_score == 90
+
+def test_fingerprint_depends_on_ranker_and_dataset_version():
+    convo = conversation("Lots of light, please.")
+    key = fingerprint(QUERY, "v1", convo, Ranker)
+
+    assert key == fingerprint(QUERY, "v1", [dict(m) for m in convo], Ranker)
+    assert key != fingerprint(QUERY, "v1", convo, BatchRanker)
+    assert key != fingerprint(QUERY, "v2", convo, Ranker)
+
+def test_near_identical_budgets_share_scores():
+    convo = conversation("Lots of light, please.")
+    nearby = QUERY.model_copy(update={"maximum_rent": 3400})
+
+    assert fingerprint(QUERY, "v1", convo, Ranker) == fingerprint(nearby, "v1", convo, Ranker)
+
+def test_fingerprint_ignores_what_the_assistant_said():
+    convo = conversation("Lots of light, please.")
+    followed = [*convo, {"role": "assistant", "content": "Great, I'll look for somewhere bright."}]
+
+    assert fingerprint(QUERY, "v1", convo, Ranker) == fingerprint(QUERY, "v1", followed, Ranker)
+
+def test_different_transcripts_with_the_same_profile_share_scores(monkeypatch, tmp_path):
+    llm = FakeOpenAI()
+    monkeypatch.setattr(oai, "client", oai.measure(llm))
+    monkeypatch.setattr(Ranker, "CONDENSE", True)
+    profiles = iter([
+        {"summary": "A night-shift nurse who needs to sleep during the day.",
+         "must_haves": ["Quiet street", "In-unit laundry"], "nice_to_haves": ["Lots of light"],
+         "dealbreakers": ["Walk-up"]},
+        {"summary": "Works nights and sleeps in the daytime, so noise is the main worry.",
+         "must_haves": ["in-unit laundry", "quiet street."], "nice_to_haves": ["lots of  light"],
+         "dealbreakers": ["walk-up"]},
+    ])
+
+    def fingerprinted(wants: str) -> str:
+        llm.responses = {"Preferences": next(profiles)}
+        it = Interview(conversation(wants), Notes())
+        return fingerprint(QUERY, "v1", asyncio.run(Ranker.preferences(it)), Ranker)
+
+    first = fingerprinted("I'm a nurse on nights, so I sleep days and need it quiet. Laundry in the unit too.")
+    second = fingerprinted("Quiet is a must, I work nights. And a washer, and no walk-ups!")
+    assert first == second
+
+    path = str(tmp_path / "scores.sqlite")
+    ScoreCache(enabled=True, path=path).put(first, 42, ListingScore(benefits=["Quiet street"], drawbacks=[], final_score=90))
+    # Another worker process, sharing the file
+    other = ScoreCache(enabled=True, path=path)
+    assert other.get(second, 42).final_score == 90
+    assert (other.hits, other.misses) == (1, 0)
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+import fakesheets
+from sheets import Notes, Writer
+
+def reopen() -> fakesheets.Spreadsheet:
+    """
+    The spreadsheet as another process would see it.
+    """
+    return fakesheets.service_account().open("FindBot Spreadsheet")
+
+def test_notes_round_trip():
+    notes = Notes()
+    notes.log("Looking for a two bedroom")
+    notes.log({"role": "user", "content": "Near a park, please."})
+    notes.status("COMPLETED: FindBot chose 1, 2, 3")
+    notes.flush()
+
+    sheet = reopen()
+    log = sheet.worksheet(f"Interview #{notes.number}")
+    for event in ["Looking for a two bedroom", "user: Near a park, please.", "COMPLETED: FindBot chose 1, 2, 3"]:
+        assert log.find(event, in_column=2) is not None
+    row = sheet.sheet1.find(str(notes.number), in_column=1).row
+    assert sheet.sheet1.batch_get([f"C{row}"]) == [[["COMPLETED: FindBot chose 1, 2, 3"]]]
+
+    reopened = Notes.from_id(notes.number)
+    assert reopened.log_sheet.title == log.title
+
+def test_flush_does_not_wait_for_other_interviews(monkeypatch):
+    (mine, busy) = (Notes(), Notes())
+    # Writing a batch takes longer than the other interview takes to log again, so the queue is never empty
+    monkeypatch.setattr(fakesheets, "LATENCY", 0.1)
+    stop = threading.Event()
+
+    def chatter():
+        while not stop.is_set():
+            busy.log("Still talking")
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=chatter)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        mine.log("Done")
+        start = time.monotonic()
+        mine.flush()
+        took = time.monotonic() - start
+    finally:
+        stop.set()
+        thread.join()
+
+    assert took < 2 * Writer.LINGER + 1
+    assert reopen().worksheet(f"Interview #{mine.number}").find("Done", in_column=2) is not None
+
+def test_notes_started_together_get_their_own_numbers(monkeypatch):
+    count = Notes.count.__func__
+    def slow_count(cls) -> int:
+        # Lingering before the number is recorded, so they would all take the same one without the lock
+        number = count(cls)
+        time.sleep(0.01)
+        return number
+    monkeypatch.setattr(Notes, "count", classmethod(slow_count))
+
+    async def start(count: int) -> list[Notes]:
+        return await asyncio.gather(*(Notes.acreate() for _ in range(count)))
+
+    numbers = [notes.number for notes in asyncio.run(start(8))]
+
+    assert len(set(numbers)) == 8
+    assert {f"Interview #{n}" for n in numbers} <= {ws.title for ws in reopen().sheets}
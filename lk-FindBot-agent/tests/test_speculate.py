@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import data
+import oai
+from bench import FakeOpenAI
+from data import Listings
+from interview import Interview
+from programmer import Programmer
+from ranker import Ranker
+from sheets import Notes
+from speculate import Speculator, digest
+
+QUERY = {"minimum_rent": 2000, "maximum_rent": 4000, "minimum_bathrooms": 1, "minimum_bedrooms": 1,
+         "neighborhoods": None}
+PROFILE = {"summary": "A nurse on nights who needs to sleep through the day.",
+           "must_haves": ["Quiet street"], "nice_to_haves": ["Lots of light"], "dealbreakers": ["Walk-up"]}
+
+@pytest.fixture
+def llm(monkeypatch) -> FakeOpenAI:
+    llm = FakeOpenAI()
+    llm.responses = {"ApartmentQuery": QUERY, "Preferences": PROFILE}
+    monkeypatch.setattr(oai, "client", oai.measure(llm))
+    return llm
+
+def transcript(turns: int) -> list:
+    convo = []
+    for turn in range(turns):
+        convo.append({"role": "assistant", "content": f"Question {turn}?"})
+        convo.append({"role": "user", "content": f"Answer {turn}."})
+    return convo
+
+def test_drafted_scores_are_reused_after_the_interviewer_answers(llm):
+    notes = Notes()
+    speculator = Speculator(data.dataset)
+
+    # Drafted as the user finishes each of their last few turns, saying nothing that changes the profile
+    for turns in range(3, 7):
+        asyncio.run(speculator.speculate(Interview(transcript(turns), notes)))
+    draft = speculator.draft
+    assert len(draft.scores) == Speculator.PRESCORE
+    # A query and a profile per draft, and the listings scored once
+    assert llm.calls == 4 * 2 + Speculator.PRESCORE
+
+    # The interviewer has the last word
+    final = [*transcript(6), {"role": "assistant", "content": "Thanks, I'll find you somewhere."}]
+    iv = Interview(final, notes)
+    assert draft.transcript == digest(final)
+
+    before = llm.calls
+    listings = asyncio.run(Programmer(iv).query(data.dataset, draft=draft.query))
+    assert asyncio.run(draft.holds(iv, draft.query, data.dataset.version, Ranker))
+
+    iv.prescored = draft.scores
+    scored = Listings.model_construct(root=[lst for lst in listings.root if lst.zpid in draft.scores])
+    ranked = asyncio.run(Ranker.rank_all(iv, scored))
+
+    assert len(ranked) == len(scored.root) > 0
+    # Only the final profile was asked for
+    assert llm.calls == before + 1
+
+def test_drafted_scores_are_dropped_when_the_profile_changes(llm):
+    notes = Notes()
+    speculator = Speculator(data.dataset)
+    asyncio.run(speculator.speculate(Interview(transcript(3), notes)))
+    draft = speculator.draft
+
+    llm.responses["Preferences"] = {**PROFILE, "dealbreakers": ["Walk-up", "No dishwasher"]}
+    iv = Interview(transcript(4), notes)
+
+    assert not asyncio.run(draft.holds(iv, draft.query, data.dataset.version, Ranker))
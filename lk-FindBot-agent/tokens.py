@@ -0,0 +1,9 @@
+
+# OpenAI bills a low-detail image as a flat 85 tokens
+IMAGE_TOKENS = 85
+
+def estimate_tokens(text: str) -> int:
+    """
+    A rough token count for `text`, using the ~4 characters per token rule of thumb.
+    """
+    return -(-len(text) // 4)